@@ -0,0 +1,493 @@
+#
+# Copyright (C) 2013  Per Myren
+#
+# This file is part of Bryton-Strava-Uploader
+#
+# Bryton-Strava-Uploader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bryton-Strava-Uploader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bryton-Strava-Uploader.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Benchmarks exporting and uploading tracks against local stand-ins for
+BrytonBridge and Strava.
+
+Each track count is run in its own process, so that the peak memory use of
+one run doesn't hide the next one.  For example:
+
+    python benchmark.py --tracks 1,50,500 --size 100000 --latency 0.005
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import shutil
+import tempfile
+import datetime
+import itertools
+import threading
+import subprocess
+import optparse
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+    def handle_error(self, request, client_address):
+        # The client's kept-alive connections are reset when a run ends
+        pass
+
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+
+    def send(self, body, content_type='application/json', code=200,
+             headers=()):
+
+        time.sleep(self.server.fake.latency)
+
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, *args):
+        pass
+
+
+
+class FakeServer(object):
+    """An HTTP server on a free local port, running in a daemon thread."""
+
+    handler = None
+
+    def __init__(self, latency=0):
+
+        self.latency = latency
+
+        self._server = _Server(('127.0.0.1', 0), self.handler)
+        self._server.fake = self
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+        t = threading.Thread(target=self._server.serve_forever)
+        t.daemon = True
+        t.start()
+
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+
+def _trackNames(count):
+
+    start = datetime.datetime(2013, 5, 1, 8, 0)
+    return [(start + datetime.timedelta(hours=i)).strftime('%Y/%m/%d %H:%M')
+            for i in range(count)]
+
+
+
+class _BrytonBridgeHandler(_Handler):
+
+    def do_GET(self):
+
+        fake = self.server.fake
+        url = urlparse.urlparse(self.path)
+        args = dict(urlparse.parse_qsl(url.query))
+
+        if url.path == '/device/info':
+            info = {'connected': True, 'Device': {'tracks': fake.tracks},
+                    'BB': {'version': '2.6.0.8'}}
+            return self.send(json.dumps(info))
+
+        if url.path == '/device/do/export':
+            for i in args['list'].split(','):
+                fake.export(int(i), args['dest'])
+            return self.send(json.dumps({'ok': True}))
+
+        self.send('', code=404)
+
+
+
+class FakeBrytonBridge(FakeServer):
+    """Serves the device info and exports tracks of size bytes, taking
+    export_delay seconds for each track."""
+
+    handler = _BrytonBridgeHandler
+
+    def __init__(self, track_count, size, export_delay=0, latency=0):
+
+        super(FakeBrytonBridge, self).__init__(latency)
+
+        self.tracks = _trackNames(track_count)
+        self.size = size
+        self.export_delay = export_delay
+
+        # Time each file was completely written, by file name
+        self.exported = {}
+
+
+    def export(self, i, dest):
+
+        time.sleep(self.export_delay)
+
+        name = self.tracks[i]
+        filename = name.replace('/', '').replace(' ', '').replace(':', '')
+        filename += '.tcx'
+
+        head = '<TrainingCenterDatabase><!-- %s -->' % name
+        with open(os.path.join(dest, filename), 'wb') as f:
+            f.write(head)
+            f.write('x' * max(0, self.size - len(head)))
+
+        self.exported[filename] = time.time()
+
+
+
+_LOGIN_PAGE = '''<html><body>
+<form id="login_form" action="/session" method="post">
+<input name="email"><input type="password" name="password">
+</form></body></html>'''
+
+_UPLOAD_PAGE = '''<html><body>
+<form action="/upload/files" method="post" enctype="multipart/form-data">
+<input type="file" name="files[]" multiple>
+</form></body></html>'''
+
+
+
+class _StravaHandler(_Handler):
+
+    def do_GET(self):
+
+        fake = self.server.fake
+        url = urlparse.urlparse(self.path)
+
+        if url.path == '/robots.txt':
+            return self.send('User-agent: *\nDisallow:\n', 'text/plain')
+        if url.path == '/login':
+            return self.send(_LOGIN_PAGE, 'text/html')
+        if url.path == '/dashboard':
+            return self.send('<html><body></body></html>', 'text/html')
+        if url.path == '/upload/select':
+            return self.send(_UPLOAD_PAGE, 'text/html')
+
+        if url.path == '/upload/progress.json':
+            ids = [int(i) for name, i in urlparse.parse_qsl(url.query)
+                   if name == 'ids[]']
+            fake.polls += 1
+            return self.send(json.dumps([fake.progress(i) for i in ids]))
+
+        self.send('', code=404)
+
+
+    def do_POST(self):
+
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if self.path == '/session':
+            return self.send('', 'text/html', 302, [
+                ('Location', '/dashboard'),
+                ('Set-Cookie', 'session=benchmark; path=/')])
+
+        if self.path == '/upload/files':
+            uploads = [fake.upload(name)
+                       for name in re.findall(r'filename="([^"]*)"', body)]
+            return self.send(json.dumps(uploads))
+
+        self.send('', code=404)
+
+
+
+class FakeStrava(FakeServer):
+    """Serves the login and upload forms, accepts uploads, and finishes
+    processing each upload after processing_polls progress requests."""
+
+    handler = _StravaHandler
+
+    def __init__(self, processing_polls=1, latency=0):
+
+        super(FakeStrava, self).__init__(latency)
+
+        self.processing_polls = processing_polls
+        self.polls = 0
+
+        self._ids = itertools.count(1)
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+        # Time each file was received, by file name
+        self.uploaded = {}
+
+
+    def upload(self, filename):
+
+        with self._lock:
+            i = next(self._ids)
+            self._uploads[i] = [filename, 0]
+            self.uploaded[filename] = time.time()
+
+        return {'id': i, 'name': None, 'progress': 0}
+
+
+    def progress(self, i):
+
+        with self._lock:
+            upload = self._uploads[i]
+            upload[1] += 1
+            filename, polls = upload
+
+        ret = {'id': i, 'name': filename,
+               'progress': min(100, 100 * polls // self.processing_polls)}
+        if ret['progress'] == 100:
+            url = '%s/activities/%d' % (self.url, i)
+            ret['activity'] = {'name': filename, 'activity_url': url}
+        return ret
+
+
+
+def _percentile(values, p):
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _peakRss():
+
+    # In kB; ru_maxrss is in bytes on Mac OS X
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+
+def run(options, track_count):
+    """Export and upload track_count tracks, and return the measurements."""
+
+    from PyQt4.QtCore import QCoreApplication, QTimer
+
+    from strava_uploader import utils, strava, bbclient
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+
+    # The upload history and export cache would make later runs skip work
+    data_dir = tempfile.mkdtemp()
+    utils._datadir = data_dir
+
+    bb = FakeBrytonBridge(track_count, options.size, options.export_delay,
+                          options.latency)
+    st = FakeStrava(options.processing_polls, options.latency)
+
+    client = bbclient.BBClient(strava_username='benchmark',
+                               strava_password='benchmark', bb_url=bb.url,
+                               strava_endpoints=strava.StravaEndpoints(st.url))
+    client._onThreadStart()
+
+    times = {}
+    errors = []
+    uploads = []
+
+    def mark(name):
+        times.setdefault(name, time.time())
+
+    def onStatus(msg):
+        if msg == 'Exporting tracks':
+            mark('authenticated')
+
+    def onUploads(tracks):
+        mark('first_upload')
+        uploads.extend(tracks)
+
+    def onFinished(tracks):
+        mark('finished')
+        app.quit()
+
+    def onError(msg):
+        errors.append(unicode(msg))
+        app.quit()
+
+    client.tracksReady.connect(lambda tracks: mark('tracks_ready'))
+    client.uploadStatus.connect(onStatus)
+    client.stravaUploadStarted.connect(onUploads)
+    client.stravaUploadAdded.connect(onUploads)
+    client.stravaUploadFinished.connect(onFinished)
+    client.error.connect(onError)
+
+    try:
+        times['start'] = time.time()
+        client._checkStatus()
+
+        times['upload_start'] = time.time()
+        client.onUploadTracks(range(track_count))
+        times['uploaded'] = time.time()
+
+        # Processing is polled from the client's timers
+        if 'finished' not in times and not errors:
+            QTimer.singleShot(int(options.timeout * 1000), app.quit)
+            app.exec_()
+    finally:
+        client._strava.close()
+        bb.close()
+        st.close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    def since(start, end):
+        if start not in times or end not in times:
+            return None
+        return times[end] - times[start]
+
+    latencies = [st.uploaded[name] - bb.exported[name]
+                 for name in st.uploaded if name in bb.exported]
+
+    upload_time = since('authenticated', 'uploaded')
+
+    return {
+        'tracks': track_count,
+        'uploads': len(uploads),
+        'errors': errors,
+        'device_info': since('start', 'tracks_ready'),
+        'authenticate': since('upload_start', 'authenticated'),
+        'first_upload': since('authenticated', 'first_upload'),
+        'export_upload': upload_time,
+        'processing': since('uploaded', 'finished'),
+        'total': since('start', 'finished'),
+        'tracks_per_s': upload_time and track_count / upload_time,
+        'mb_per_s': upload_time and
+                track_count * options.size / upload_time / 1e6,
+        'latency_median': _percentile(latencies, 0.5),
+        'latency_p95': _percentile(latencies, 0.95),
+        'latency_max': _percentile(latencies, 1.0),
+        'progress_polls': st.polls,
+        'peak_rss_kb': _peakRss(),
+    }
+
+
+
+_COLUMNS = [
+    ('tracks', 'tracks', '%d'),
+    ('uploads', 'uploads', '%d'),
+    ('device_info', 'device s', '%.3f'),
+    ('authenticate', 'auth s', '%.3f'),
+    ('first_upload', '1st up s', '%.3f'),
+    ('export_upload', 'exp+up s', '%.3f'),
+    ('processing', 'proc s', '%.3f'),
+    ('tracks_per_s', 'tracks/s', '%.1f'),
+    ('mb_per_s', 'MB/s', '%.2f'),
+    ('latency_median', 'lat p50', '%.3f'),
+    ('latency_p95', 'lat p95', '%.3f'),
+    ('latency_max', 'lat max', '%.3f'),
+    ('progress_polls', 'polls', '%d'),
+    ('peak_rss_kb', 'rss kB', '%d'),
+]
+
+
+def _printResults(results):
+
+    print ' '.join('%9s' % title for key, title, fmt in _COLUMNS)
+    for result in results:
+        cells = []
+        for key, title, fmt in _COLUMNS:
+            value = result.get(key)
+            cells.append('%9s' % ('-' if value is None else fmt % value))
+        print ' '.join(cells)
+
+        for error in result['errors']:
+            print '    error: %s' % error
+
+
+
+def main():
+
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--tracks', default='1,50,500',
+                      help='comma separated track counts [%default]')
+    parser.add_option('--size', type='int', default=100000,
+                      help='size of each exported track in bytes [%default]')
+    parser.add_option('--latency', type='float', default=0.005,
+                      help='seconds added to each response [%default]')
+    parser.add_option('--export-delay', type='float', default=0.01,
+                      help='seconds BrytonBridge takes to export each track '
+                      '[%default]')
+    parser.add_option('--processing-polls', type='int', default=2,
+                      help='progress requests before Strava has processed '
+                      'an upload [%default]')
+    parser.add_option('--timeout', type='float', default=600,
+                      help='seconds to wait for processing [%default]')
+    parser.add_option('--json', action='store_true',
+                      help='print the results as JSON')
+    parser.add_option('--child', type='int', help=optparse.SUPPRESS_HELP)
+    parser.add_option('--child-output', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.child is not None:
+        # Written to a file, since stdout may get other output too
+        with open(options.child_output, 'w') as f:
+            json.dump(run(options, options.child), f)
+        return
+
+    # Every run gets a fresh process, for its own peak RSS
+    child_args = ['--size', str(options.size),
+                  '--latency', repr(options.latency),
+                  '--export-delay', repr(options.export_delay),
+                  '--processing-polls', str(options.processing_polls),
+                  '--timeout', repr(options.timeout)]
+    results = []
+    fd, output = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        for count in options.tracks.split(','):
+            cmd = [sys.executable, os.path.abspath(__file__),
+                   '--child', count, '--child-output', output] + child_args
+            subprocess.check_call(cmd)
+            with open(output) as f:
+                results.append(json.load(f))
+    finally:
+        os.remove(output)
+
+    if options.json:
+        print json.dumps(results, indent=2)
+    else:
+        _printResults(results)
+
+
+
+if __name__ == '__main__':
+    main()
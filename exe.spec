@@ -3,7 +3,12 @@
 
 a = Analysis(['uploader.py'],
              pathex=[],
-             hiddenimports=[],
+             # imported by name on first access (see mechanize/__init__.py)
+             hiddenimports=['strava_uploader.mechanize._lwpcookiejar',
+                            'strava_uploader.mechanize._firefox3cookiejar',
+                            'strava_uploader.mechanize._mozillacookiejar',
+                            'strava_uploader.mechanize._msiecookiejar',
+                            'strava_uploader.mechanize._form'],
              hookspath=None)
 
 pyz = PYZ(a.pure)
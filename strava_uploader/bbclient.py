@@ -22,16 +22,24 @@
 import urlparse
 import urllib
 import urllib2
+import httplib
+import socket
 import json
 import errno
+import hashlib
 import shutil
 import tempfile
 import os
-import time
+import threading
+import Queue
 
 from PyQt4.QtCore import QObject, pyqtSignal, QTimer
 
 from .strava import StravaUploader, StravaError
+from .history import UploadHistory
+from .exportcache import ExportCache
+from .vault import Vault, VaultError
+from .utils import data_path
 
 
 BASE_BB_URL = 'http://127.0.0.1:18888'
@@ -40,6 +48,34 @@ BASE_BB_URL = 'http://127.0.0.1:18888'
 SUPPORTED_VERSIONS = ['2.6.0.8']
 
 
+# The device status is polled every STATUS_INTERVAL_MIN ms after it has
+# changed, and then less and less often while it stays the same, up to every
+# STATUS_INTERVAL_OFFLINE ms while no device is connected and every
+# STATUS_INTERVAL_CONNECTED ms while one is.
+STATUS_INTERVAL_MIN = 1000
+STATUS_INTERVAL_OFFLINE = 3000
+STATUS_INTERVAL_CONNECTED = 6000
+STATUS_BACKOFF = 1.5
+
+# Seconds to wait for BrytonBridge to answer a status poll
+STATUS_TIMEOUT = 5
+
+
+# Number of tracks uploaded to Strava at the same time
+UPLOAD_WORKERS = 3
+
+
+# Strava upload progress is polled every POLL_INTERVAL_MIN ms at first, and
+# then less and less often, up to every POLL_INTERVAL_MAX ms, for uploads
+# that take a long time to process.
+POLL_INTERVAL_MIN = 1000
+POLL_INTERVAL_MAX = 10000
+POLL_BACKOFF = 1.5
+
+# Polling gives up after this many network errors in a row
+POLL_ERRORS_MAX = 5
+
+
 class BBClient(QObject):
 
     deviceOffline = pyqtSignal()
@@ -51,61 +87,94 @@ class BBClient(QObject):
     uploadStatus = pyqtSignal(str)
     stravaCredentialsNeeded = pyqtSignal()
     stravaUploadStarted = pyqtSignal(list)
+    stravaUploadAdded = pyqtSignal(list)
     stravaUploadProgress = pyqtSignal(list)
     stravaUploadFinished = pyqtSignal(list)
 
 
 
     def __init__(self, parent=None, strava_username=None,
-                 strava_password=None, bb_url=BASE_BB_URL):
+                 strava_password=None, bb_url=BASE_BB_URL,
+                 strava_endpoints=None):
 
         super(BBClient, self).__init__(parent)
         self._bb_url = bb_url
+        self._strava_endpoints = strava_endpoints
 
         self._connected = False
         self._first_run = True
         self._status_timer = None
+        self._progress_timer = None
+        self._progress_errors = 0
+        self._upload_status = None
 
         self._strava_username = strava_username
         self._strava_password = strava_password
+        self._strava_session_unchecked = False
 
         self._tracks = []
-        self._exp_tracks = []
+
+        self._track_ids = []
+        self._force_upload = False
+        self._uploaded = None
+        self._upload_tracks = {}
 
 
     def _onThreadStart(self):
 
         self._status_timer = QTimer(self)
         self._status_timer.timeout.connect(self._checkStatus)
-        self._strava = StravaUploader()
+        self._device_watcher = _DeviceWatcher(self._bb_url)
+
+        self._progress_timer = QTimer(self)
+        self._progress_timer.setSingleShot(True)
+        self._progress_timer.timeout.connect(self._checkProgress)
+
+        self._strava = StravaUploader(self._strava_endpoints,
+                                      data_path('robots.json'))
+        self._history = UploadHistory(data_path('history.db'))
+        self._export_cache = ExportCache(data_path('exports'))
+
+        # The Strava login session is kept between runs, encrypted, so that
+        # the first upload doesn't have to authenticate again.  It's checked
+        # with Strava after the first device status poll.
+        self._vault = Vault(data_path('vault.key'))
+        self._session_path = data_path('session')
+        QTimer.singleShot(0, self._restoreStravaSession)
 
         self.error.connect(self._onError)
 
 
     def _onError(self):
         self._status_timer.stop()
+        self._stopProgress()
         self._connected = False
         self._first_run = True
         self._tracks = []
-        self._exp_tracks = []
+        self._device_watcher.reset()
 
 
     def onAbortUpload(self):
 
-        self._exp_tracks = []
+        self._stopProgress()
 
 
 
 
-    def onUploadTracks(self, track_ids):
+    def onUploadTracks(self, track_ids, force=False):
+        """Upload the tracks with these indexes.  Unless force is True,
+        tracks that the upload history says are on Strava are skipped."""
 
         self._track_ids = track_ids
+        self._force_upload = force
 
-        if not self._exp_tracks:
-            self.uploadStatus.emit('Exporting tracks')
-            self._exp_tracks = self._exportTracks(track_ids)
-
+        # A restored session that couldn't be checked at startup is checked
+        # again, since that is cheaper than authenticating
+        if not self._strava.authenticated and self._strava_session_unchecked:
+            self._checkStravaSession()
 
+        # Authenticate before exporting, since tracks are uploaded as soon
+        # as they have been exported
         if not self._strava.authenticated:
 
             self.uploadStatus.emit('Authenticating to Strava')
@@ -122,31 +191,113 @@ class BBClient(QObject):
                 self.stravaCredentialsNeeded.emit()
                 return
 
+            self._saveStravaSession()
+
+
+        if not self._tracks:
+            return
+
+        # Tracks that are already on Strava aren't exported or uploaded again
+        ids = []
+        self._uploaded = []
+        for i in track_ids:
+            found = None
+            if not force:
+                found = self._history.findName(self._tracks[i])
+            if found is None:
+                ids.append(i)
+            else:
+                self._uploaded.append(
+                    _uploadedEntry(i, self._tracks[i], found))
+
+        uploads = []
+        if ids:
+            self.uploadStatus.emit('Exporting tracks')
+
+            uploads = self._exportAndUpload(ids)
+            if uploads is None:
+                return
+
+        if not uploads:
+            # Nothing to wait for, every track was already on Strava
+            if self._uploaded:
+                self._showUploads([])
+            if self._uploaded is None:
+                self.stravaUploadFinished.emit([])
+            return
+
+        # Progress is polled from a timer, so that the thread's event loop
+        # keeps running while Strava processes the uploads
+        self._upload_status = self._strava.status(uploads)
+        self._progress_errors = 0
+        self._progress_timer.start(POLL_INTERVAL_MIN)
+
+
+    def _checkProgress(self):
 
-        tracks = self._exp_tracks
-        self._exp_tracks = []
+        if self._upload_status is None:
+            return
 
-        self.uploadStatus.emit(
-            'Uploading to strava<br>(Can sometimes be a little slow)')
         try:
-            status = self._strava.upload(tracks)
+            finished, progress = self._upload_status.check_progress()
         except StravaError as e:
             self.error.emit(e.reason)
             return
+        except (urllib2.URLError, httplib.HTTPException,
+                EnvironmentError) as e:
+            # Probably a passing network problem, so try again later
+            self._progress_errors += 1
+            if self._progress_errors >= POLL_ERRORS_MAX:
+                self.error.emit(str(getattr(e, 'reason', e)))
+                return
+            self._backOffProgress()
+            return
 
-        self.stravaUploadStarted.emit(status.uploads)
+        self._progress_errors = 0
+
+        # Only uploads that Strava made an activity of are recorded, so
+        # failed ones are uploaded again next time
+        for u in progress:
+            if u['id'] not in self._upload_tracks:
+                continue
+            if u.get('error'):
+                del self._upload_tracks[u['id']]
+            elif 'activity' in u:
+                name, digest = self._upload_tracks.pop(u['id'])
+                self._history.add(name, digest, u['id'],
+                                  u['activity'].get('activity_url'))
+
+        if finished:
+            self._upload_status = None
+            self._upload_tracks = {}
+            self._saveStravaSession()
+            self.stravaUploadFinished.emit(progress)
+            return
 
-        while True:
+        if progress:
+            self.stravaUploadProgress.emit(progress)
 
-            time.sleep(2)
+        self._backOffProgress()
 
-            finished, progress = status.check_progress()
 
-            if not finished:
-                self.stravaUploadProgress.emit(progress)
-            else:
-                self.stravaUploadFinished.emit(progress)
-                return
+    def _backOffProgress(self):
+
+        interval = self._progress_timer.interval() * POLL_BACKOFF
+        self._progress_timer.start(int(min(interval, POLL_INTERVAL_MAX)))
+
+
+    def _stopProgress(self):
+
+        self._upload_status = None
+        if self._progress_timer is not None:
+            self._progress_timer.stop()
+
+        # Uploads that are no longer followed are recorded by their upload
+        # id, since Strava would reject them as duplicates if they were
+        # uploaded again.  Upload again forces them if they failed there.
+        for upload_id, (name, digest) in self._upload_tracks.iteritems():
+            self._history.add(name, digest, upload_id, None)
+        self._upload_tracks = {}
 
 
 
@@ -155,18 +306,66 @@ class BBClient(QObject):
         self._strava_username = username
         self._strava_password = password
 
-        self.onUploadTracks(self._track_ids)
+        self.onUploadTracks(self._track_ids, self._force_upload)
 
     def onClearStravaCredentials(self):
         self._strava_username = None
         self._strava_password = None
-        if self._strava.authenticated:
-            self._strava = StravaUploader()
+        self._clearStravaSession()
+        self._strava.close()
+        self._strava = StravaUploader(self._strava_endpoints,
+                                      data_path('robots.json'))
+
+
+
+
+    def _restoreStravaSession(self):
+
+        data = self._vault.read(self._session_path)
+        if data is None:
+            return
+
+        self._strava.restoreSession(data)
+        self._strava_session_unchecked = True
+        self._checkStravaSession()
+
+
+    def _checkStravaSession(self):
+
+        try:
+            valid = self._strava.checkSession()
+        except StravaError as e:
+            # Probably offline, try again before the next upload
+            return
+
+        self._strava_session_unchecked = False
+        if not valid:
+            self._clearStravaSession()
+
+
+    def _saveStravaSession(self):
+
+        # Failing to save only means authenticating again on the next run
+        try:
+            self._vault.write(self._session_path, self._strava.saveSession())
+        except (VaultError, EnvironmentError) as e:
+            pass
+
+
+    def _clearStravaSession(self):
+
+        self._strava_session_unchecked = False
+        try:
+            os.remove(self._session_path)
+        except OSError as e:
+            pass
 
 
     def onStart(self):
         if self._status_timer is not None:
-            self._status_timer.start(1000)
+            self._status_timer.start(STATUS_INTERVAL_MIN)
+            # Rather than waiting for the timer, so the device shows up soon
+            self._checkStatus()
         else:
             QTimer.singleShot(1000, self.onStart)
 
@@ -174,133 +373,514 @@ class BBClient(QObject):
 
     def _checkStatus(self):
 
-        info = self._bbRequest('/device/info')
-        if info is None:
+        info, error = self._device_watcher.poll()
+        if error is not None:
+            self.error.emit(error)
             return
 
-        if info['connected']:
-            if not self._connected and 'Device' in info:
-                self._connected = True
-                self._status_timer.setInterval(6000)
-                self.tracksReady.emit(info['Device']['tracks'])
-                self._tracks = info['Device']['tracks']
-
-                if 'BB' in info and 'version' in info['BB']:
-                    if info['BB']['version'] not in SUPPORTED_VERSIONS:
-                        self.unsupportedBBVersion.emit(info['BB']['version'])
+        # info is None if the status hasn't changed since the last poll
+        changed = info is not None and self._updateDevice(info)
+        self._first_run = False
 
+        # Poll often while the status changes, and less often while it doesn't
+        if changed:
+            interval = STATUS_INTERVAL_MIN
+        elif self._connected:
+            interval = min(self._status_timer.interval() * STATUS_BACKOFF,
+                           STATUS_INTERVAL_CONNECTED)
         else:
+            interval = min(self._status_timer.interval() * STATUS_BACKOFF,
+                           STATUS_INTERVAL_OFFLINE)
+
+        if int(interval) != self._status_timer.interval():
+            self._status_timer.setInterval(int(interval))
+
+
+    def _updateDevice(self, info):
+
+        if not info['connected']:
             if self._connected or self._first_run:
                 self._connected = False
-                self._status_timer.setInterval(3000)
                 self.deviceOffline.emit()
+                return True
+            return False
 
+        if 'Device' not in info:
+            return False
 
-        if self._first_run and self._status_timer.interval() == 1000:
-            self._status_timer.setInterval(3000)
+        tracks = info['Device']['tracks']
+        if self._connected and tracks == self._tracks:
+            return False
 
-        self._first_run = False
+        if self._upload_status is not None:
+            # The tracks being uploaded are indexes into the current list, so
+            # a new list is only picked up once the upload is done
+            self._device_watcher.reset()
+            return False
 
+        was_connected = self._connected
+        self._connected = True
+        self._tracks = tracks
+        self.tracksReady.emit(tracks)
 
+        if not was_connected and 'BB' in info and 'version' in info['BB']:
+            if info['BB']['version'] not in SUPPORTED_VERSIONS:
+                self.unsupportedBBVersion.emit(info['BB']['version'])
 
-    def _exportTracks(self, ids):
+        return True
 
-        if not self._tracks:
-            return []
 
-        tmp_path = tempfile.mkdtemp()
 
-        resp = self._bbRequest('/device/do/export', fmt='tcx',
-                               list=','.join(map(str, ids)),
-                               num=len(self._tracks), dest=tmp_path)
+    def _exportAndUpload(self, ids):
 
-        content = []
+        pool = _UploadPool(self._strava, UPLOAD_WORKERS)
 
-        if resp is not None and 'ok' in resp and resp['ok']:
+        # Tracks exported by an earlier attempt are uploaded from the cache,
+        # without asking BrytonBridge to export them again
+        pending = []
+        for i in ids:
+            cached = self._export_cache.get(self._exportKey(i))
+            if cached is None:
+                pending.append(i)
+            else:
+                self._uploadExport(pool, i, *cached)
+
+        # BrytonBridge doesn't answer the export request until every track
+        # has been written, so run it in the background and upload the files
+        # as they appear in the export directory.
+        export = None
+        if pending:
+            tmp_path = tempfile.mkdtemp()
+            export = _ExportJob(self._bb_url, tmp_path, pending,
+                                len(self._tracks))
+
+        matcher = _TrackMatcher(self._tracks, pending)
+        seen = set()
+        uploads = []
+        error = None
 
-            names = os.listdir(tmp_path)
+        try:
+            while error is None:
+
+                export_done = export is None or export.done()
+
+                names = []
+                if export is not None:
+                    names = [n for n in os.listdir(tmp_path) if n not in seen]
+                if names and not export_done:
+                    # The newest file may still be being written; it's
+                    # complete once the next one appears or the export ends
+                    names.sort(key=lambda n: os.path.getmtime(
+                        os.path.join(tmp_path, n)))
+                    names.pop()
+
+                for name in names:
+                    seen.add(name)
+                    i = matcher.match(name)
+                    if i is None:
+                        # Not a track we asked for
+                        continue
+
+                    path = self._export_cache.put(
+                        self._exportKey(i), name, os.path.join(tmp_path, name))
+                    self._uploadExport(pool, i, name, path)
+
+                for result in pool.results(0.2):
+                    self._addUploads(uploads, *result)
+
+                if export_done:
+                    if export is not None and export.error is not None:
+                        error = export.error
+                    elif pool.finished == pool.submitted:
+                        break
+        finally:
+            pool.close()
+            # Uploads that were sent before an error are still recorded
+            for result in pool.results(0):
+                self._addUploads(uploads, *result)
+            if export is not None:
+                export.join()
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            self._export_cache.evict()
+
+        if error is not None:
+            self.error.emit(error)
+            return None
+
+        # The tracks that were exported have been uploaded; the ones that
+        # weren't are shown as failed
+        failed = [_failedEntry(i, self._tracks[i],
+                               'Failed to export %s' % self._tracks[i])
+                  for i in matcher.unmatched()]
+        if failed:
+            self._showUploads(failed)
+
+        return uploads
+
+
+    def _uploadExport(self, pool, i, filename, path):
+
+        digest = _fileDigest(path)
+
+        # The same ride may be on the device under another name
+        found = None
+        if not self._force_upload:
+            found = self._history.findDigest(digest)
+        if found is not None:
+            self._showUploads([_uploadedEntry(i, self._tracks[i], found)])
+            return
 
-            if len(names) == len(ids):
+        pool.submit(filename, path, (i, self._tracks[i], digest))
 
-                matches = self._matchNames(ids, names)
 
-                if matches is None:
-                    self.error.emit('Failed to export tracks')
-                else:
-                    for name in matches:
-                        with open(os.path.join(tmp_path, name)) as f:
-                            content.append((name, f.read()))
+    def _addUploads(self, uploads, track, result, exc):
 
-            else:
-                self.error.emit('Failed to export tracks')
+        i, name, digest = track
+        if exc is not None:
+            # Only this track failed, the others are still uploaded
+            result = [_failedEntry(i, name, exc.reason)]
+        else:
+            for u in result:
+                self._upload_tracks[u['id']] = (name, digest)
+            uploads.extend(result)
 
-        shutil.rmtree(tmp_path)
+        self._showUploads(result)
 
-        return content
 
+    def _exportKey(self, i):
 
+        return u'%d:%s' % (i, self._tracks[i])
 
 
-    def _matchNames(self, ids, filenames):
 
-        ret = []
 
-        for i, fname in zip(ids, filenames):
+    def _showUploads(self, uploads):
 
-            name = self._tracks[i]
+        # The first uploads switch the GUI to the progress view, and the
+        # tracks that were already on Strava are shown along with them
+        if self._uploaded is not None:
+            self.stravaUploadStarted.emit(self._uploaded + uploads)
+            self._uploaded = None
+        else:
+            self.stravaUploadAdded.emit(uploads)
 
-            name = name.replace('/', '').replace(' ', '').replace(':', '')
 
-            if fname.startswith(name):
-                ret.append(fname)
 
-        if len(ret) == len(filenames):
-            return ret
 
-        ret = []
+def _fileDigest(path):
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), ''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+
+def _uploadedEntry(i, name, found):
+
+    # A progress entry for a track that is already on Strava
+    upload_id, activity_url = found
+
+    entry = {'id': 'uploaded-%d' % i, 'name': name, 'progress': 100}
+    if activity_url:
+        entry['activity'] = {'name': name, 'activity_url': activity_url}
+
+    return entry
+
 
-        fnames = filenames[:]
 
+def _failedEntry(i, name, error):
+
+    # A progress entry for a track that couldn't be exported or uploaded
+    return {'id': 'failed-%d' % i, 'name': name, 'progress': 100,
+            'error': error}
+
+
+
+def _bbFetch(bb_url, path, **args):
+
+    url = urlparse.urljoin(bb_url, path)
+
+    if args:
+        url += '?' + urllib.urlencode(args)
+
+    error = 'Unknown network error'
+    try:
+        req = urllib2.urlopen(url)
+        return json.loads(req.read()), None
+
+    except urllib2.URLError as e:
+        if e.reason.errno == errno.ECONNREFUSED:
+            error = 'Failed to connect to BrytonBridge'
+    except urllib.HTTPError as e:
+        if e.reason == 'Not Found':
+            error = 'Unknown network error'
+    else:
+        pass
+
+    return None, error
+
+
+
+class _DeviceWatcher(object):
+    """Polls the BrytonBridge device status over one persistent connection.
+
+    The status is fingerprinted by its ETag, when BrytonBridge sends one, and
+    by a hash of the raw body, so that it is only decoded when it has changed.
+    """
+
+    def __init__(self, bb_url, path='/device/info'):
+
+        url = urlparse.urlsplit(urlparse.urljoin(bb_url, path))
+        self._host = url.netloc
+        self._path = url.path
+
+        self._conn = None
+        self._etag = None
+        self._digest = None
+
+
+    def poll(self):
+        """Return (info, error), where info is None if nothing has changed."""
+
+        try:
+            status, etag, body = self._fetch()
+        except (socket.error, httplib.HTTPException) as e:
+            self.close()
+            if getattr(e, 'errno', None) == errno.ECONNREFUSED:
+                return None, 'Failed to connect to BrytonBridge'
+            return None, 'Unknown network error'
+
+        if status == httplib.NOT_MODIFIED:
+            return None, None
+        if status != httplib.OK:
+            return None, 'Unknown network error'
+
+        self._etag = etag
+        digest = hashlib.sha1(body).digest()
+        if digest == self._digest:
+            return None, None
+
+        try:
+            info = json.loads(body)
+        except ValueError:
+            return None, 'Unknown network error'
+
+        self._digest = digest
+        return info, None
+
+
+    def reset(self):
+        """Forget the last status, so that the next poll reports it again."""
+
+        self._etag = None
+        self._digest = None
+
+
+    def close(self):
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+    def _fetch(self):
+
+        headers = {}
+        if self._etag is not None:
+            headers['If-None-Match'] = self._etag
+
+        # BrytonBridge may have closed a connection that has been idle
+        # between polls, so a reused connection is retried once
+        reused = self._conn is not None
+        try:
+            return self._request(headers)
+        except socket.timeout:
+            # BrytonBridge is busy, and a new connection wouldn't help
+            raise
+        except (socket.error, httplib.HTTPException):
+            self.close()
+            if not reused:
+                raise
+
+        return self._request(headers)
+
+
+    def _request(self, headers):
+
+        if self._conn is None:
+            self._conn = httplib.HTTPConnection(self._host,
+                                                timeout=STATUS_TIMEOUT)
+
+        self._conn.request('GET', self._path, headers=headers)
+        resp = self._conn.getresponse()
+        return resp.status, resp.getheader('etag'), resp.read()
+
+
+
+class _TrackMatcher(object):
+    """Finds the track that an exported file was exported from.
+
+    Exported files are named after the track, without the characters that
+    aren't allowed in file names.  The normalized track names are indexed by
+    length, so a file name is only looked up once for each distinct name
+    length, and the longest matching name wins.
+    """
+
+    def __init__(self, tracks, ids):
+
+        self._names = {}
         for i in ids:
+            name = tracks[i].replace('/', '').replace(' ', '').replace(':', '')
+            self._names.setdefault(name, []).append(i)
 
-            name = self._tracks[i]
+        self._lengths = sorted(set(len(n) for n in self._names), reverse=True)
 
-            name = name.replace('/', '').replace(' ', '').replace(':', '')
 
-            for fname in fnames:
-                if fname.startswith(name):
-                    ret.append(fname)
-                    fnames.remove(fname)
-                    break
+    def match(self, fname):
+        """Return the id of the track fname belongs to, or None.
 
-        if len(ret) == len(filenames):
-            return ret
+        Each track is only matched once.
+        """
+
+        for length in self._lengths:
+            ids = self._names.get(fname[:length])
+            if ids:
+                return ids.pop(0)
 
         return None
 
 
-    def _bbRequest(self, path, **args):
+    def unmatched(self):
+        """Return the ids of the tracks that no file has matched."""
+
+        ret = []
+        for ids in self._names.itervalues():
+            ret.extend(ids)
+
+        return sorted(ret)
+
+
+
+class _ExportJob(object):
+    """Asks BrytonBridge to export tracks, from a background thread."""
+
+    def __init__(self, bb_url, dest, ids, num_tracks):
+
+        self.resp = None
+        self.error = None
+
+        self._thread = threading.Thread(
+            target=self._run, args=(bb_url, dest, ids, num_tracks))
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def _run(self, bb_url, dest, ids, num_tracks):
+
+        self.resp, self.error = _bbFetch(
+            bb_url, '/device/do/export', fmt='tcx',
+            list=','.join(map(str, ids)), num=num_tracks, dest=dest)
+
+
+    def done(self):
+        return not self._thread.is_alive()
+
+
+    def join(self):
+        self._thread.join()
+
+
+
+class _UploadPool(object):
+    """Uploads files to Strava from a fixed number of worker threads.
+
+    Each file is uploaded on its own, so each gets its own Strava upload id
+    and progress entry.
+    """
+
+    def __init__(self, strava, workers):
+
+        self._strava = strava
+        self._jobs = Queue.Queue()
+        self._results = Queue.Queue()
 
-        url = urlparse.urljoin(self._bb_url, path)
+        self.submitted = 0
+        self.finished = 0
 
-        if args:
-            url += '?' + urllib.urlencode(args)
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
 
-        error = 'Unknown network error'
+
+    def submit(self, filename, path, track):
+        self._jobs.put((filename, path, track))
+        self.submitted += 1
+
+
+    def results(self, timeout):
+        """Return the (track, uploads, error) results that are ready.
+
+        Waits up to timeout seconds for the first one.
+        """
+
+        ret = []
         try:
-            req = urllib2.urlopen(url)
-            return json.loads(req.read())
-
-        except urllib2.URLError as e:
-            if e.reason.errno == errno.ECONNREFUSED:
-                error = 'Failed to connect to BrytonBridge'
-        except urllib.HTTPError as e:
-            if e.reason == 'Not Found':
-                error = 'Unknown network error'
-        else:
+            ret.append(self._results.get(timeout=timeout))
+            while True:
+                ret.append(self._results.get_nowait())
+        except Queue.Empty:
             pass
 
-        self.error.emit(error)
+        self.finished += len(ret)
+        return ret
+
+
+    def close(self):
+
+        # Uploads that have already started are allowed to finish, since
+        # their files can't be removed while they are being sent
+        while True:
+            try:
+                self._jobs.get_nowait()
+            except Queue.Empty:
+                break
+
+        for t in self._threads:
+            self._jobs.put(None)
+        for t in self._threads:
+            t.join()
+
+
+    def _work(self):
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            filename, path, track = job
+
+            # A result is posted for every job, whatever goes wrong, since
+            # _exportAndUpload waits until there is one for each
+            result = (track, None, StravaError('Upload failed'))
+            try:
+                status = self._strava.upload([(filename, path)])
+                result = (track, status.uploads, None)
+            except StravaError as e:
+                result = (track, None, e)
+            except Exception as e:
+                # Network and file errors that the uploader doesn't wrap
+                result = (track, None,
+                          StravaError(str(getattr(e, 'reason', e)) or
+                                      e.__class__.__name__))
+            finally:
+                self._results.put(result)
 
 
 
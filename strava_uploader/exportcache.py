@@ -0,0 +1,125 @@
+#
+# Copyright (C) 2013  Per Myren
+#
+# This file is part of Bryton-Strava-Uploader
+#
+# Bryton-Strava-Uploader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bryton-Strava-Uploader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bryton-Strava-Uploader.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import hashlib
+import os
+import shutil
+
+
+
+class ExportCache(object):
+    """Directory of TCX files exported by BrytonBridge.
+
+    Each export is stored in a directory of its own, named after a hash of
+    its key, under the file name BrytonBridge gave it.  The modification time
+    of the directory records when it was last used, and the least recently
+    used exports are removed by evict() once the cache holds more than
+    max_size bytes.
+    """
+
+    def __init__(self, path, max_size=100 * 1024 * 1024):
+
+        self._path = path
+        self.max_size = max_size
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+
+    def get(self, key):
+        """Return (filename, path) of the export stored for key, or None."""
+
+        entry = self._entryPath(key)
+
+        try:
+            names = os.listdir(entry)
+        except OSError:
+            return None
+
+        if len(names) != 1:
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+        os.utime(entry, None)
+
+        return names[0], os.path.join(entry, names[0])
+
+
+    def put(self, key, filename, src):
+        """Move the exported file src into the cache.
+
+        Returns the path of the file in the cache.
+        """
+
+        entry = self._entryPath(key)
+
+        shutil.rmtree(entry, ignore_errors=True)
+        os.makedirs(entry)
+
+        path = os.path.join(entry, filename)
+        shutil.move(src, path)
+
+        return path
+
+
+    def evict(self):
+        """Remove the least recently used exports, down to max_size bytes."""
+
+        entries = []
+        total = 0
+
+        try:
+            names = os.listdir(self._path)
+        except OSError:
+            return
+
+        for name in names:
+            entry = os.path.join(self._path, name)
+            if not os.path.isdir(entry):
+                continue
+
+            # An entry may be removed by get() meanwhile
+            try:
+                size = 0
+                for f in os.listdir(entry):
+                    size += os.path.getsize(os.path.join(entry, f))
+                mtime = os.path.getmtime(entry)
+            except OSError:
+                continue
+
+            entries.append((mtime, size, entry))
+            total += size
+
+        entries.sort()
+
+        for mtime, size, entry in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+    def _entryPath(self, key):
+
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+
+        return os.path.join(self._path, hashlib.sha1(key).hexdigest())
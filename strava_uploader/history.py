@@ -0,0 +1,81 @@
+#
+# Copyright (C) 2013  Per Myren
+#
+# This file is part of Bryton-Strava-Uploader
+#
+# Bryton-Strava-Uploader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bryton-Strava-Uploader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bryton-Strava-Uploader.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import sqlite3
+import time
+
+
+
+class UploadHistory(object):
+    """On-disk record of the tracks that have been uploaded to Strava.
+
+    Uploads are keyed by the name of the track on the device and a hash of
+    the exported TCX file, and record the Strava upload id and the URL of the
+    activity it created.
+    """
+
+    def __init__(self, path):
+
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS uploads ('
+            'name TEXT NOT NULL, '
+            'digest TEXT NOT NULL, '
+            'upload_id INTEGER, '
+            'activity_url TEXT, '
+            'uploaded REAL NOT NULL, '
+            'PRIMARY KEY (name, digest))')
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS uploads_digest ON uploads (digest)')
+        self._db.commit()
+
+
+    def findName(self, name):
+        """Return (upload_id, activity_url) of the last upload of the track
+        with this name, or None."""
+
+        return self._find('name', name)
+
+
+    def findDigest(self, digest):
+        """Return (upload_id, activity_url) of the last upload of a track
+        with this content hash, or None."""
+
+        return self._find('digest', digest)
+
+
+    def add(self, name, digest, upload_id, activity_url):
+
+        self._db.execute(
+            'INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?)',
+            (name, digest, upload_id, activity_url, time.time()))
+        self._db.commit()
+
+
+    def close(self):
+        self._db.close()
+
+
+    def _find(self, column, value):
+
+        return self._db.execute(
+            'SELECT upload_id, activity_url FROM uploads WHERE %s = ? '
+            'ORDER BY uploaded DESC LIMIT 1' % column, (value,)).fetchone()
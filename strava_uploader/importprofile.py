@@ -0,0 +1,147 @@
+#
+# Copyright (C) 2013  Per Myren
+#
+# This file is part of Bryton-Strava-Uploader
+#
+# Bryton-Strava-Uploader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bryton-Strava-Uploader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bryton-Strava-Uploader.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Measures how long each module takes to import.
+
+Python 2 has no -X importtime, and the frozen exe has no console to pass it
+on anyway, so __import__ is wrapped instead.  Enabled by setting
+BSU_IMPORT_PROFILE (see README.rst).
+"""
+
+import __builtin__
+import atexit
+import os
+import sys
+import time
+
+
+
+ENV_VAR = 'BSU_IMPORT_PROFILE'
+
+
+class ImportProfiler(object):
+    """Records the time taken by every module imported while installed.
+
+    Each module gets the time since profiling started when its import began,
+    its own import time, and its cumulative time including the modules it
+    imported in turn.
+    """
+
+    def __init__(self):
+
+        self._import = None
+        self._start = None
+        self._seen = set()
+        # [time in nested imports, modules loaded] per __import__ being timed
+        self._stack = []
+        # (started at, self time, cumulative time, module names)
+        self.entries = []
+
+
+    def install(self):
+
+        self._import = __builtin__.__import__
+        self._start = time.time()
+        self._seen = set(sys.modules)
+        __builtin__.__import__ = self._timedImport
+
+
+    def uninstall(self):
+
+        if self._import is not None:
+            __builtin__.__import__ = self._import
+            self._import = None
+
+
+    def _timedImport(self, name, *args, **kwds):
+
+        # A module is in sys.modules before its body runs, so anything new
+        # by now was loaded by the import whose body is running
+        self._claim()
+        started = time.time()
+        self._stack.append([0.0, []])
+        try:
+            return self._import(name, *args, **kwds)
+        finally:
+            self._claim()
+            children, loaded = self._stack.pop()
+            elapsed = time.time() - started
+
+            # Most imports find the module already loaded, and the time
+            # they take is left to the importing module
+            if loaded:
+                if self._stack:
+                    self._stack[-1][0] += elapsed
+                self.entries.append((started - self._start,
+                                     elapsed - children, elapsed,
+                                     sorted(loaded)))
+
+
+    def _claim(self):
+
+        if len(sys.modules) == len(self._seen) or not self._stack:
+            return
+
+        new = [m for m in sys.modules if m not in self._seen]
+        self._seen.update(new)
+        # None entries are py2's failed implicit relative imports
+        self._stack[-1][1].extend(m for m in new if sys.modules[m] is not None)
+
+
+    def report(self, out, limit=None):
+        """Write the imports, slowest (cumulative) first."""
+
+        total = sum(e[1] for e in self.entries)
+        out.write('%d modules imported in %.1f ms\n\n' %
+                  (len(self.entries), total * 1000))
+        out.write('%9s %9s %9s  %s\n' % ('at ms', 'self ms', 'cumul ms',
+                                          'module'))
+
+        entries = sorted(self.entries, key=lambda e: e[2], reverse=True)
+        for at, own, cumulative, names in entries[:limit]:
+            out.write('%9.1f %9.2f %9.2f  %s\n' % (
+                at * 1000, own * 1000, cumulative * 1000, ', '.join(names)))
+
+
+
+def start():
+    """Profile imports if BSU_IMPORT_PROFILE is set, and write the report
+    when the process exits.  Returns the profiler, or None."""
+
+    path = os.environ.get(ENV_VAR)
+    if not path:
+        return None
+
+    profiler = ImportProfiler()
+    profiler.install()
+
+    def write():
+        profiler.uninstall()
+        if path == '-':
+            profiler.report(sys.stderr)
+            return
+        try:
+            with open(path, 'w') as out:
+                profiler.report(out)
+        except IOError:
+            pass
+
+    atexit.register(write)
+    return profiler
@@ -21,17 +21,25 @@
 import sys
 import math
 
-from PyQt4.QtCore import Qt, QThread, QTimer, QSize, pyqtSignal, QSettings
+from PyQt4.QtCore import (
+    Qt, QThread, QTimer, QSize, pyqtSignal, QSettings,
+    QAbstractListModel, QModelIndex, QVariant
+)
 from PyQt4.QtGui import (
     QApplication, QIcon, QWidget,
     QVBoxLayout, QHBoxLayout, QPainter, QPen, QBrush, QPalette,
-    QLabel, QPixmap, QStackedWidget, QListWidget, QPushButton,
+    QLabel, QPixmap, QImageReader, QStackedWidget, QListView, QPushButton,
     QDialog, QLineEdit, QGridLayout, QDialogButtonBox, QCheckBox,
     QMessageBox, QProgressBar, QScrollArea, QSizePolicy, QFrame
 )
 
-from .utils import resource_path
-from .bbclient import BBClient, SUPPORTED_VERSIONS
+from .utils import resource_path, data_path
+from .vault import Vault, VaultError, KeyFileError, isEncrypted
+from . import startup
+
+
+# Upload progress is repainted at most once every FRAME_INTERVAL ms
+FRAME_INTERVAL = 16
 
 
 
@@ -51,12 +59,30 @@ class MainWindow(QWidget):
 
         self._showLoading('Searching for device')
 
-        self._createWorkerThread()
+        # The worker thread, and the network stack it imports, are only
+        # created once the window has been painted
+        self._painted = False
+
+
+    def paintEvent(self, event):
 
-        QTimer.singleShot(1000, self._bb_client.onStart)
+        super(MainWindow, self).paintEvent(event)
+
+        if not self._painted:
+            self._painted = True
+            startup.mark('First paint')
+            QTimer.singleShot(0, self._finishStartup)
+
+
+    def _finishStartup(self):
+
+        self._loadLogo()
+        self._createWorkerThread()
 
 
     def _onUnsupportedVersion(self, ver):
+        from .bbclient import SUPPORTED_VERSIONS
+
         self.warning_label.setText(
         'You are using an unsupported version of BrytonBridge. '
         'It may or may not work as expected. '
@@ -99,6 +125,8 @@ class MainWindow(QWidget):
 
     def _onTracksReady(self, tracks):
 
+        startup.mark('Device detected')
+
         self.tracklist.setTracks(tracks)
         self._showWidget(self.tracklist)
 
@@ -109,6 +137,8 @@ class MainWindow(QWidget):
 
     def _onDeviceOffline(self):
 
+        startup.mark('No device detected')
+
         self._showMessage('Please connect your device',
                          resource_path('images/connect.png'))
 
@@ -146,18 +176,43 @@ class MainWindow(QWidget):
         settings = self._getSettings()
 
         u = settings.value('strava/username').toString()
-        p = settings.value('strava/password').toString()
+        p = unicode(settings.value('strava/password').toString())
 
         if not u or not p:
             return None, None
 
-        return u, p
+        if not isEncrypted(p):
+            # Saved in plain text by an older version.  It's removed even if
+            # it can't be saved encrypted, and then asked for next time.
+            settings.remove('strava/password')
+            self._saveStravaCredentials(u, p)
+            return u, p
+
+        try:
+            return u, self._getVault().decrypt(p).decode('utf-8')
+        except KeyFileError:
+            return None, None
+        except (VaultError, UnicodeDecodeError):
+            # Encrypted with a key that has been replaced, so it's asked for
+            # again
+            settings.remove('strava/password')
+            return None, None
 
 
     def _saveStravaCredentials(self, username, password):
 
         settings = self._getSettings()
 
+        # The password is never stored in plain text
+        try:
+            password = self._getVault().encrypt(
+                unicode(password).encode('utf-8'))
+        except (VaultError, EnvironmentError) as e:
+            QMessageBox.warning(self, 'Warning', 'The password could not be '
+                                'saved: %s. It will be asked for again next '
+                                'time.' % e)
+            return
+
         settings.setValue('strava/username', username)
         settings.setValue('strava/password', password)
 
@@ -168,8 +223,13 @@ class MainWindow(QWidget):
     def _getSettings(self):
         return QSettings('BrytonGPS', 'BrytonStravaUploader')
 
+    def _getVault(self):
+        return Vault(data_path('vault.key'))
+
     def _createWorkerThread(self):
 
+        from .bbclient import BBClient
+
         self._worker_thread = QThread(self)
 
 
@@ -179,6 +239,7 @@ class MainWindow(QWidget):
         self._bb_client.moveToThread(self._worker_thread)
 
         self._worker_thread.started.connect(self._bb_client._onThreadStart)
+        self._worker_thread.started.connect(self._bb_client.onStart)
         self._worker_thread.finished.connect(self._bb_client.deleteLater)
 
 
@@ -192,6 +253,8 @@ class MainWindow(QWidget):
 
         self._bb_client.uploadStatus.connect(self._onUploadStatus)
         self._bb_client.stravaUploadStarted.connect(self._onUploadStarted)
+        self._bb_client.stravaUploadAdded.connect(
+            self.upload_progress.addTracks)
         self._bb_client.stravaUploadProgress.connect(
             self.upload_progress.updateProgress)
         self._bb_client.stravaUploadFinished.connect(
@@ -248,6 +311,13 @@ class MainWindow(QWidget):
         self._showWidget(self.tracklist)
 
 
+    def _loadLogo(self):
+
+        pix = QPixmap(resource_path('images/logo.png'))
+        pix = pix.scaledToWidth(400, Qt.SmoothTransformation)
+        self.logo.setPixmap(pix)
+
+
     def _createLayout(self):
 
         l = QVBoxLayout()
@@ -255,12 +325,13 @@ class MainWindow(QWidget):
 
         l.addWidget(self.warning_label)
 
-        logo = QLabel(self)
-
-        pix = QPixmap(resource_path('images/logo.png'))
-        pix = pix.scaledToWidth(400, Qt.SmoothTransformation)
-        logo.setPixmap(pix)
-        l.addWidget(logo)
+        # The logo is loaded after the first paint, but its size is known
+        # now so that the layout doesn't move then
+        self.logo = QLabel(self)
+        size = QImageReader(resource_path('images/logo.png')).size()
+        if size.isValid():
+            self.logo.setMinimumHeight(size.height() * 400 / size.width())
+        l.addWidget(self.logo)
 
         l.addWidget(self.widgets, 1)
 
@@ -342,14 +413,18 @@ class LoadingWidget(QWidget):
 
 class TracklistWidget(QWidget):
 
-    requestUpload = pyqtSignal(list)
+    requestUpload = pyqtSignal(list, bool)
 
 
     def __init__(self, parent=None):
         super(TracklistWidget, self).__init__(parent)
 
-        self.tracklist = QListWidget(self)
-        self.tracklist.setSelectionMode(QListWidget.NoSelection)
+        self.tracks = TrackListModel(self)
+
+        self.tracklist = QListView(self)
+        self.tracklist.setSelectionMode(QListView.NoSelection)
+        self.tracklist.setUniformItemSizes(True)
+        self.tracklist.setModel(self.tracks)
 
         self.upload_button = QPushButton(
             QIcon(resource_path('images/strava-button.png')),
@@ -364,6 +439,11 @@ class TracklistWidget(QWidget):
         self.clear_password.setIconSize(QSize(20, 20))
         self.clear_password.hide()
 
+        # For tracks that are gone from Strava, or failed there, although
+        # the upload history says they were uploaded
+        self.upload_again = QCheckBox('Upload again, even if already on '
+                                      'Strava', self)
+
 
         self.upload_button.clicked.connect(self._onUploadClicked)
 
@@ -372,32 +452,18 @@ class TracklistWidget(QWidget):
 
 
     def setTracks(self, tracks):
-        self.tracklist.clear()
-        self.tracklist.addItems(tracks)
+        self.tracks.setTracks(tracks)
 
-        for i, name in enumerate(tracks):
-            self.tracklist.item(i).setCheckState(Qt.Unchecked)
-            self.tracklist.item(i).setSizeHint(QSize(200, 25))
-
-        if tracks:
-            self.tracklist.item(i).setCheckState(Qt.Checked)
-            self.upload_button.setEnabled(True)
-        else:
-            self.upload_button.setEnabled(False)
+        self.upload_button.setEnabled(bool(tracks))
 
 
     def _onUploadClicked(self):
 
-        ids = []
-        for i in range(self.tracklist.count()):
-
-            item = self.tracklist.item(i)
-            if item.checkState() == Qt.Checked:
-                ids.append(i)
-
+        ids = self.tracks.checkedRows()
 
         if ids:
-            self.requestUpload.emit(ids)
+            self.requestUpload.emit(ids, self.upload_again.isChecked())
+            self.upload_again.setChecked(False)
 
 
 
@@ -405,6 +471,7 @@ class TracklistWidget(QWidget):
 
         l = QVBoxLayout()
         l.addWidget(self.tracklist)
+        l.addWidget(self.upload_again)
 
         h = QHBoxLayout()
         h.addWidget(self.upload_button)
@@ -415,6 +482,109 @@ class TracklistWidget(QWidget):
 
 
 
+class TrackListModel(QAbstractListModel):
+
+    """Names of the tracks on the device, each with a check box.
+
+    The check states are kept in a bytearray, one byte per track.
+    """
+
+    def __init__(self, parent=None):
+        super(TrackListModel, self).__init__(parent)
+
+        self._tracks = []
+        self._checked = bytearray()
+
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._tracks)
+
+
+    def data(self, index, role=Qt.DisplayRole):
+
+        if not index.isValid():
+            return QVariant()
+
+        row = index.row()
+
+        if role == Qt.DisplayRole:
+            return QVariant(self._tracks[row])
+        elif role == Qt.CheckStateRole:
+            if self._checked[row]:
+                return QVariant(Qt.Checked)
+            return QVariant(Qt.Unchecked)
+        elif role == Qt.SizeHintRole:
+            return QVariant(QSize(200, 25))
+
+        return QVariant()
+
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsUserCheckable
+
+
+    def setData(self, index, value, role=Qt.EditRole):
+
+        if not index.isValid() or role != Qt.CheckStateRole:
+            return False
+
+        state, ok = value.toInt()
+        self._checked[index.row()] = int(state == Qt.Checked)
+        self.dataChanged.emit(index, index)
+
+        return True
+
+
+    def setTracks(self, tracks):
+
+        old = self._tracks
+        if tracks == old:
+            return
+
+        # Only the rows between the unchanged start and end of the list are
+        # removed and inserted
+        n = min(len(old), len(tracks))
+        start = 0
+        while start < n and old[start] == tracks[start]:
+            start += 1
+        end = 0
+        while end < n - start and old[-1 - end] == tracks[-1 - end]:
+            end += 1
+
+        # The unchanged rows keep their check states
+        removed = len(old) - end - start
+        if removed > 0:
+            self.beginRemoveRows(QModelIndex(), start, start + removed - 1)
+            self._tracks = old[:start] + old[len(old) - end:]
+            del self._checked[start:start + removed]
+            self.endRemoveRows()
+
+        inserted = len(tracks) - end - start
+        if inserted > 0:
+            self.beginInsertRows(QModelIndex(), start, start + inserted - 1)
+            self._tracks = list(tracks)
+            self._checked[start:start] = bytearray(inserted)
+            # A new last track is the latest ride, checked as for a new
+            # device
+            if end == 0:
+                self._checked[-1] = 1
+            self.endInsertRows()
+
+
+    def checkedRows(self):
+
+        rows = []
+        i = self._checked.find('\x01')
+        while i != -1:
+            rows.append(i)
+            i = self._checked.find('\x01', i + 1)
+
+        return rows
+
+
+
 class LoginDialog(QDialog):
 
     def __init__(self, parent=None):
@@ -494,38 +664,82 @@ class UploadProgressWidget(QWidget):
 
         self._first_display = True
 
+        # Progress signals are queued, and applied at most once per frame
+        self._queued = {}
+        self._rendered = {}
+        self._update_timer = QTimer(self)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(FRAME_INTERVAL)
+        self._update_timer.timeout.connect(self._applyQueued)
+
 
     def updateProgress(self, tracks):
 
         for track in tracks:
-            w = self._widgets[track['id']]
-
-            if 'error' in track and track['error']:
-                w.label.setText('<font color="red">%s</font>' % track['error'])
-                w.progress.setValue(100)
+            self._queued[track['id']] = track
 
-            elif track['name'] is not None:
-                w.label.setText(track['name'])
-                w.progress.setValue(track['progress'])
-
-                if track['progress'] == 100:
-
-                    if 'activity' in track and 'activity_url' in track['activity']:
-                        name = track['activity']['name']
-                        url = track['activity']['activity_url']
-                        w.label.setText(
-                            '<a href="%s"><font color="green">%s</font></a>' \
-                            % (url, name))
-                    else:
-                        name = track['name']
-                        w.label.setText('<font color="green">%s</font>' % name)
+        if not self._update_timer.isActive():
+            self._update_timer.start()
 
 
     def onFinished(self, tracks):
         self.updateProgress(tracks)
+        self._applyQueued()
         self.close_button.setEnabled(True)
 
 
+    def _applyQueued(self):
+
+        self._update_timer.stop()
+
+        queued = self._queued
+        self._queued = {}
+
+        for track_id, track in queued.iteritems():
+            self._render(self._widgets[track_id], track)
+
+
+    def _render(self, w, track):
+
+        # Only touch the label and progress bar if what they show changes,
+        # since setting rich text makes the scroll area redo its layout
+        state = self._trackState(track)
+        if state is None:
+            return
+
+        text, value = state
+        old_text, old_value = self._rendered.get(track['id'], (None, None))
+
+        if text != old_text:
+            w.label.setText(text)
+        if value != old_value:
+            w.progress.setValue(value)
+
+        self._rendered[track['id']] = state
+
+
+    def _trackState(self, track):
+
+        if 'error' in track and track['error']:
+            return '<font color="red">%s</font>' % track['error'], 100
+
+        if track['name'] is None:
+            return None
+
+        if track['progress'] != 100:
+            return track['name'], track['progress']
+
+        if 'activity' in track and 'activity_url' in track['activity']:
+            name = track['activity']['name']
+            url = track['activity']['activity_url']
+            text = '<a href="%s"><font color="green">%s</font></a>' \
+                % (url, name)
+        else:
+            text = '<font color="green">%s</font>' % track['name']
+
+        return text, 100
+
+
     def setTracks(self, tracks):
 
         if not self._first_display:
@@ -534,15 +748,15 @@ class UploadProgressWidget(QWidget):
         self._first_display = False
 
         self._widgets = {}
+        self._queued = {}
+        self._rendered = {}
         parent = QWidget(self)
         l = QVBoxLayout(parent)
-        for track in tracks:
-            w = self._createTrackProgress(parent, track)
-            l.addWidget(w)
-            self._widgets[track['id']] = w
-
         l.addStretch(1)
         parent.setLayout(l)
+        self._tracks_layout = l
+
+        self.addTracks(tracks)
 
         scroll = QScrollArea(self)
         scroll.setWidgetResizable(True)
@@ -558,6 +772,18 @@ class UploadProgressWidget(QWidget):
         self.close_button.setEnabled(False)
 
 
+    def addTracks(self, tracks):
+
+        parent = self._tracks_layout.parentWidget()
+
+        for track in tracks:
+            w = self._createTrackProgress(parent, track)
+            # Keep the stretch at the end
+            self._tracks_layout.insertWidget(
+                self._tracks_layout.count() - 1, w)
+            self._widgets[track['id']] = w
+
+
     def _removeOldWidgets(self):
 
 
@@ -587,14 +813,10 @@ class UploadProgressWidget(QWidget):
         label.setOpenExternalLinks(True)
         label.setWordWrap(True)
 
-        if track['name'] is not None:
-            label.setText(track['name'])
-        elif track['error']:
-            label.setText('<font color="red">%s</font>' % track['error'])
-            p.setValue(100)
-
         w.label = label
 
+        self._render(w, track)
+
 
         l.addWidget(label)
         l.addWidget(p)
@@ -5,6 +5,7 @@ __all__ = [
     'Browser',
     'BrowserStateError',
     'CacheFTPHandler',
+    'ConnectionPool',
     'ContentTooShortError',
     'Cookie',
     'CookieJar',
@@ -52,6 +53,7 @@ __all__ = [
     'ProxyHandler',
     'Request',
     'RobotExclusionError',
+    'RobotRulesCache',
     'RobustFactory',
     'RobustFormsFactory',
     'RobustLinksFactory',
@@ -115,6 +117,7 @@ __all__ = [
 
 import logging
 import sys
+import types
 
 from _version import __version__
 
@@ -151,55 +154,56 @@ from _util import http2time as str2time
 from _clientcookie import Cookie, CookiePolicy, DefaultCookiePolicy, \
      CookieJar, FileCookieJar, LoadError, request_host_lc as request_host, \
      effective_request_host
-from _lwpcookiejar import LWPCookieJar, lwp_cookie_str
-# 2.4 raises SyntaxError due to generator / try/finally use
-if sys.version_info[:2] > (2,4):
-    try:
-        import sqlite3
-    except ImportError:
-        pass
-    else:
-        from _firefox3cookiejar import Firefox3CookieJar
-from _mozillacookiejar import MozillaCookieJar
-from _msiecookiejar import MSIECookieJar
 
-# forms
-from _form import (
-    AmbiguityError,
-    ControlNotFoundError,
-    FormParser,
-    ItemCountError,
-    ItemNotFoundError,
-    LocateError,
-    Missing,
-    ParseError,
-    ParseFile,
-    ParseFileEx,
-    ParseResponse,
-    ParseResponseEx,
-    ParseString,
-    XHTMLCompatibleFormParser,
-    # deprecated
-    CheckboxControl,
-    Control,
-    FileControl,
-    HTMLForm,
-    HiddenControl,
-    IgnoreControl,
-    ImageControl,
-    IsindexControl,
-    Item,
-    Label,
-    ListControl,
-    PasswordControl,
-    RadioControl,
-    ScalarControl,
-    SelectControl,
-    SubmitButtonControl,
-    SubmitControl,
-    TextControl,
-    TextareaControl,
-    )
+# Rarely used parts of the API, which are imported when first accessed:
+# the file-based cookie jars and the ClientForm API (which brings in
+# BeautifulSoup).  Forms found by a Browser import _form when they're parsed.
+_lazy_attrs = {}
+for _module_name, _names in [
+    ("_lwpcookiejar", ["LWPCookieJar", "lwp_cookie_str"]),
+    ("_firefox3cookiejar", ["Firefox3CookieJar"]),
+    ("_mozillacookiejar", ["MozillaCookieJar"]),
+    ("_msiecookiejar", ["MSIECookieJar"]),
+    ("_form", [
+        "AmbiguityError",
+        "ControlNotFoundError",
+        "FormParser",
+        "ItemCountError",
+        "ItemNotFoundError",
+        "LocateError",
+        "Missing",
+        "ParseError",
+        "ParseFile",
+        "ParseFileEx",
+        "ParseResponse",
+        "ParseResponseEx",
+        "ParseString",
+        "XHTMLCompatibleFormParser",
+        # deprecated
+        "CheckboxControl",
+        "Control",
+        "FileControl",
+        "HTMLForm",
+        "HiddenControl",
+        "IgnoreControl",
+        "ImageControl",
+        "IsindexControl",
+        "Item",
+        "Label",
+        "ListControl",
+        "PasswordControl",
+        "RadioControl",
+        "ScalarControl",
+        "SelectControl",
+        "SubmitButtonControl",
+        "SubmitControl",
+        "TextControl",
+        "TextareaControl",
+        ]),
+    ]:
+    for _name in _names:
+        _lazy_attrs[_name] = _module_name
+del _module_name, _names, _name
 
 # If you hate the idea of turning bugs into warnings, do:
 # import mechanize; mechanize.USE_BARE_EXCEPT = False
@@ -209,3 +213,25 @@ logger = logging.getLogger("mechanize")
 if logger.level is logging.NOTSET:
     logger.setLevel(logging.CRITICAL)
 del logger
+
+
+class _LazyModule(types.ModuleType):
+    """This package, importing the names in _lazy_attrs on first access."""
+
+    def __getattr__(self, name):
+        try:
+            module_name = _lazy_attrs[name]
+        except KeyError:
+            raise AttributeError("'module' object has no attribute %r" % name)
+        module = __import__(module_name, globals(), {}, [name])
+        value = getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+_module = _LazyModule(__name__, __doc__)
+_module.__dict__.update(globals())
+# the original module object must live on, since Python 2 clears a module's
+# globals (which this module's functions use) when it is deleted
+_module._original_module = sys.modules[__name__]
+sys.modules[__name__] = _module
+del _module._module, _module
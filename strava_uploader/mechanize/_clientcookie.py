@@ -180,6 +180,19 @@ def effective_request_host(request):
     """Return the effective request-host, as defined by RFC 2965."""
     return eff_request_host(request)[1]
 
+def _suffixes(s):
+    # all suffixes of s, longest first, including the empty string
+    return [s[i:] for i in range(len(s)+1)]
+
+def _prefixes(s):
+    # all prefixes of s, longest first, including the empty string
+    return [s[:i] for i in range(len(s), -1, -1)]
+
+def _default_method(obj, cls, name):
+    # true if obj's method name is cls's, rather than an override
+    method = getattr(obj, name, None)
+    return getattr(method, "im_func", None) is getattr(cls, name).im_func
+
 def request_path(request):
     """Return path component of request-URI, as defined by RFC 2965."""
     url = request.get_full_url()
@@ -1053,8 +1066,25 @@ class CookieJar:
             policy = DefaultCookiePolicy()
         self._policy = policy
 
+        self._cookies_lock = _threading.RLock()
         self._cookies = {}
 
+        # Cookie header memo: (key -> (cookies, header)), valid while
+        # self._cookies is the same dict and unchanged, until _memo_expires
+        self._header_memo = {}
+        self._memo_cookies = None
+        self._memo_expires = None
+        # earliest expiry time of any cookie in _expiry_cookies (None if no
+        # cookie expires); not known unless that is self._cookies
+        self._next_expiry = None
+        self._expiry_cookies = None
+        self._memoizable = True
+        for name in ["cookies_for_request", "_cookies_for_request",
+                     "_cookies_for_domain", "_cookie_attrs", "set_cookie",
+                     "clear", "clear_expired_cookies", "__iter__"]:
+            if not _default_method(self, CookieJar, name):
+                self._memoizable = False
+
         # for __getitem__ iteration in pre-2.2 Pythons
         self._prev_getitem_index = 0
 
@@ -1063,6 +1093,7 @@ class CookieJar:
 
     def set_policy(self, policy):
         self._policy = policy
+        self._header_memo = {}
 
     def _cookies_for_domain(self, domain, request):
         cookies = []
@@ -1070,7 +1101,14 @@ class CookieJar:
             return []
         debug("Checking %s for cookies to return", domain)
         cookies_by_path = self._cookies[domain]
-        for path in cookies_by_path.keys():
+        if _default_method(self._policy, DefaultCookiePolicy, "path_return_ok"):
+            # only cookie paths that are a prefix of the request path can
+            # match, so look those up rather than checking every path
+            paths = [path for path in _prefixes(request_path(request))
+                     if path in cookies_by_path]
+        else:
+            paths = cookies_by_path.keys()
+        for path in paths:
             if not self._policy.path_return_ok(path, request):
                 continue
             cookies_by_name = cookies_by_path[path]
@@ -1097,10 +1135,28 @@ class CookieJar:
         self._policy._now = self._now = int(time.time())
         cookies = self._cookies_for_request(request)
         # add cookies in order of most specific (i.e. longest) path first
-        def decreasing_size(a, b): return cmp(len(b.path), len(a.path))
-        cookies.sort(decreasing_size)
+        cookies.sort(key=lambda cookie: len(cookie.path), reverse=True)
         return cookies
 
+    def _candidate_domains(self, request):
+        """Return the cookie domains that may have cookies for request.
+
+        DefaultCookiePolicy.domain_return_ok only accepts domains that are a
+        suffix of the (dotted) request host, so with that policy only those
+        are looked up, rather than checking every domain in the jar.
+        """
+        if not _default_method(self._policy, DefaultCookiePolicy,
+                               "domain_return_ok"):
+            return self._cookies.keys()
+        domains = []
+        for host in eff_request_host_lc(request):
+            if not host.startswith("."):
+                host = "."+host
+            for domain in _suffixes(host):
+                if domain in self._cookies and domain not in domains:
+                    domains.append(domain)
+        return domains
+
     def _cookies_for_request(self, request):
         """Return a list of cookies to be returned to server."""
         # this method still exists (alongside cookies_for_request) because it
@@ -1108,7 +1164,7 @@ class CookieJar:
         # XXX document that implied interface, or provide another way of
         # implementing cookiejars than subclassing
         cookies = []
-        for domain in self._cookies.keys():
+        for domain in self._candidate_domains(request):
             cookies.extend(self._cookies_for_domain(domain, request))
         return cookies
 
@@ -1190,22 +1246,76 @@ class CookieJar:
         has_header, get_header, header_items and add_unredirected_header, as
         documented by urllib2.
         """
-        debug("add_cookie_header")
-        cookies = self.cookies_for_request(request)
+        self._cookies_lock.acquire()
+        try:
+            debug("add_cookie_header")
+            cookies, header = self._cookie_header(request)
 
-        attrs = self._cookie_attrs(cookies)
-        if attrs:
-            if not request.has_header("Cookie"):
-                request.add_unredirected_header("Cookie", "; ".join(attrs))
+            if header:
+                if not request.has_header("Cookie"):
+                    request.add_unredirected_header("Cookie", header)
 
-        # if necessary, advertise that we know RFC 2965
-        if self._policy.rfc2965 and not self._policy.hide_cookie2:
-            for cookie in cookies:
-                if cookie.version != 1 and not request.has_header("Cookie2"):
-                    request.add_unredirected_header("Cookie2", '$Version="1"')
-                    break
+            # if necessary, advertise that we know RFC 2965
+            if self._policy.rfc2965 and not self._policy.hide_cookie2:
+                for cookie in cookies:
+                    if cookie.version != 1 and not request.has_header("Cookie2"):
+                        request.add_unredirected_header("Cookie2", '$Version="1"')
+                        break
 
-        self.clear_expired_cookies()
+            if (not self._memoizable or
+                self._expiry_cookies is not self._cookies or
+                (self._next_expiry is not None and
+                 self._next_expiry <= self._now)):
+                self.clear_expired_cookies()
+        finally:
+            self._cookies_lock.release()
+
+    def _header_memo_key(self, request):
+        # Everything the cookies returned for request depend on, other than
+        # the jar's contents and the time; None if that isn't known (a
+        # CookieJar subclass or a policy other than DefaultCookiePolicy).
+        policy = self._policy
+        if not self._memoizable or type(policy) is not DefaultCookiePolicy:
+            return None
+        return (request.get_type(), eff_request_host_lc(request),
+                request_port(request), request_path(request),
+                request_is_unverifiable(request) and is_third_party(request),
+                policy.netscape, policy.rfc2965,
+                policy.strict_rfc2965_unverifiable,
+                policy.strict_ns_unverifiable, policy.strict_ns_domain,
+                policy._blocked_domains, policy._allowed_domains)
+
+    def _cookie_header(self, request):
+        """Return (cookies, Cookie header value) for request.
+
+        The result is memoized per request host, port and path until the
+        cookies change or one of the cookies returned expires.
+        """
+        now = int(time.time())
+        key = self._header_memo_key(request)
+        if key is not None:
+            if (self._memo_cookies is not self._cookies or
+                (self._memo_expires is not None and
+                 self._memo_expires <= now)):
+                self._header_memo = {}
+            if not self._header_memo:
+                self._memo_cookies = self._cookies
+                self._memo_expires = None
+            result = self._header_memo.get(key)
+            if result is not None:
+                self._policy._now = self._now = now
+                return result
+
+        cookies = self.cookies_for_request(request)
+        result = cookies, "; ".join(self._cookie_attrs(cookies))
+        if key is not None:
+            self._header_memo[key] = result
+            for cookie in cookies:
+                if cookie.expires is not None and (
+                    self._memo_expires is None or
+                    cookie.expires < self._memo_expires):
+                    self._memo_expires = cookie.expires
+        return result
 
     def _normalized_cookie_tuples(self, attrs_set):
         """Return list of tuples containing normalised cookie information.
@@ -1493,12 +1603,20 @@ class CookieJar:
 
         cookie: mechanize.Cookie instance
         """
-        c = self._cookies
-        if not c.has_key(cookie.domain): c[cookie.domain] = {}
-        c2 = c[cookie.domain]
-        if not c2.has_key(cookie.path): c2[cookie.path] = {}
-        c3 = c2[cookie.path]
-        c3[cookie.name] = cookie
+        self._cookies_lock.acquire()
+        try:
+            c = self._cookies
+            if not c.has_key(cookie.domain): c[cookie.domain] = {}
+            c2 = c[cookie.domain]
+            if not c2.has_key(cookie.path): c2[cookie.path] = {}
+            c3 = c2[cookie.path]
+            c3[cookie.name] = cookie
+            self._header_memo = {}
+            if cookie.expires is not None and (
+                self._next_expiry is None or cookie.expires < self._next_expiry):
+                self._next_expiry = cookie.expires
+        finally:
+            self._cookies_lock.release()
 
     def extract_cookies(self, response, request):
         """Extract cookies from response, where allowable given the request.
@@ -1520,22 +1638,26 @@ class CookieJar:
         for checking that the cookie is OK to be set.
 
         """
-        debug("extract_cookies: %s", response.info())
-        self._policy._now = self._now = int(time.time())
+        self._cookies_lock.acquire()
+        try:
+            debug("extract_cookies: %s", response.info())
+            self._policy._now = self._now = int(time.time())
 
-        for cookie in self._make_cookies(response, request):
-            if cookie.expires is not None and cookie.expires <= self._now:
-                # Expiry date in past is request to delete cookie.  This can't be
-                # in DefaultCookiePolicy, because can't delete cookies there.
-                try:
-                    self.clear(cookie.domain, cookie.path, cookie.name)
-                except KeyError:
-                    pass
-                debug("Expiring cookie, domain='%s', path='%s', name='%s'",
-                      cookie.domain, cookie.path, cookie.name)
-            elif self._policy.set_ok(cookie, request):
-                debug(" setting cookie: %s", cookie)
-                self.set_cookie(cookie)
+            for cookie in self._make_cookies(response, request):
+                if cookie.expires is not None and cookie.expires <= self._now:
+                    # Expiry date in past is request to delete cookie.  This can't be
+                    # in DefaultCookiePolicy, because can't delete cookies there.
+                    try:
+                        self.clear(cookie.domain, cookie.path, cookie.name)
+                    except KeyError:
+                        pass
+                    debug("Expiring cookie, domain='%s', path='%s', name='%s'",
+                          cookie.domain, cookie.path, cookie.name)
+                elif self._policy.set_ok(cookie, request):
+                    debug(" setting cookie: %s", cookie)
+                    self.set_cookie(cookie)
+        finally:
+            self._cookies_lock.release()
 
     def clear(self, domain=None, path=None, name=None):
         """Clear some cookies.
@@ -1549,20 +1671,25 @@ class CookieJar:
         Raises KeyError if no matching cookie exists.
 
         """
-        if name is not None:
-            if (domain is None) or (path is None):
-                raise ValueError(
-                    "domain and path must be given to remove a cookie by name")
-            del self._cookies[domain][path][name]
-        elif path is not None:
-            if domain is None:
-                raise ValueError(
-                    "domain must be given to remove cookies by path")
-            del self._cookies[domain][path]
-        elif domain is not None:
-            del self._cookies[domain]
-        else:
-            self._cookies = {}
+        self._cookies_lock.acquire()
+        try:
+            if name is not None:
+                if (domain is None) or (path is None):
+                    raise ValueError(
+                        "domain and path must be given to remove a cookie by name")
+                del self._cookies[domain][path][name]
+            elif path is not None:
+                if domain is None:
+                    raise ValueError(
+                        "domain must be given to remove cookies by path")
+                del self._cookies[domain][path]
+            elif domain is not None:
+                del self._cookies[domain]
+            else:
+                self._cookies = {}
+            self._header_memo = {}
+        finally:
+            self._cookies_lock.release()
 
     def clear_session_cookies(self):
         """Discard all session cookies.
@@ -1577,9 +1704,13 @@ class CookieJar:
         ask otherwise by passing a true ignore_discard argument.
 
         """
-        for cookie in self:
-            if cookie.discard:
-                self.clear(cookie.domain, cookie.path, cookie.name)
+        self._cookies_lock.acquire()
+        try:
+            for cookie in self:
+                if cookie.discard:
+                    self.clear(cookie.domain, cookie.path, cookie.name)
+        finally:
+            self._cookies_lock.release()
 
     def clear_expired_cookies(self):
         """Discard all expired cookies.
@@ -1591,10 +1722,20 @@ class CookieJar:
         passing a true ignore_expires argument).
 
         """
-        now = time.time()
-        for cookie in self:
-            if cookie.is_expired(now):
-                self.clear(cookie.domain, cookie.path, cookie.name)
+        self._cookies_lock.acquire()
+        try:
+            now = time.time()
+            next_expiry = None
+            for cookie in self:
+                if cookie.is_expired(now):
+                    self.clear(cookie.domain, cookie.path, cookie.name)
+                elif cookie.expires is not None and (
+                    next_expiry is None or cookie.expires < next_expiry):
+                    next_expiry = cookie.expires
+            self._next_expiry = next_expiry
+            self._expiry_cookies = self._cookies
+        finally:
+            self._cookies_lock.release()
 
     def __getitem__(self, i):
         if i == 0:
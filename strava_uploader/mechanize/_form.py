@@ -61,7 +61,6 @@ __all__ = ['AmbiguityError', 'CheckboxControl', 'Control',
 
 import HTMLParser
 from cStringIO import StringIO
-import inspect
 import logging
 import random
 import re
@@ -92,6 +91,7 @@ def debug(msg, *args, **kwds):
     if OPTIMIZATION_HACK:
         return
 
+    import inspect
     caller_name = inspect.stack()[1][3]
     extended_msg = '%%s %s' % msg
     extended_args = (caller_name,)+args
@@ -343,6 +343,130 @@ class MimeWriter:
         self._fp.write("\r\n--" + boundary + "--\r\n")
 
 
+def _file_extent(file_object):
+    """Return (offset, size) of the unread remainder of file_object.
+
+    Returns None if the file object can't report its size without being read.
+
+    """
+    try:
+        offset = file_object.tell()
+        file_object.seek(0, 2)
+        size = file_object.tell() - offset
+        file_object.seek(offset)
+    except (AttributeError, IOError, OSError):
+        return None
+    return offset, size
+
+
+class MultipartBody:
+
+    """File-like multipart/form-data request body.
+
+    This is written to by MimeWriter in place of a StringIO.  Boundaries,
+    headers and ordinary control values are kept as strings, but files added
+    with write_file are only referenced, and are read a chunk at a time as the
+    body is read.  The length of the body is known before any of it is read,
+    so it can be used for the Content-Length header.
+
+    Methods:
+
+    write(), writelines(), write_file(): used while building the body
+    read(), seek(), tell(): used while sending it
+    len(body): length of the complete body in bytes
+
+    """
+
+    def __init__(self):
+        self._parts = []  # strings and (file_object, offset, size) tuples
+        self._pending = []
+        self._length = 0
+        self._index = 0
+        self._part_pos = 0
+
+    def write(self, data):
+        if data:
+            self._pending.append(data)
+            self._length += len(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def write_file(self, file_object):
+        extent = _file_extent(file_object)
+        if extent is None:
+            # not seekable, so the only way to know its size is to read it
+            self.write(file_object.read())
+            return
+        self._flush()
+        offset, size = extent
+        self._parts.append((file_object, offset, size))
+        self._length += size
+
+    def _flush(self):
+        if self._pending:
+            self._parts.append("".join(self._pending))
+            self._pending = []
+
+    def __len__(self):
+        return self._length
+
+    def _part_size(self, part):
+        if isinstance(part, str):
+            return len(part)
+        return part[2]
+
+    def tell(self):
+        pos = self._part_pos
+        for part in self._parts[:self._index]:
+            pos += self._part_size(part)
+        return pos
+
+    def seek(self, offset, whence=0):
+        # lets a request be resent, eg. after a stale keep-alive connection
+        if whence != 0:
+            raise IOError("MultipartBody only supports absolute seeks")
+        self._flush()
+        self._index = 0
+        for part in self._parts:
+            part_size = self._part_size(part)
+            if offset < part_size:
+                break
+            offset -= part_size
+            self._index += 1
+        self._part_pos = offset
+
+    def read(self, size=-1):
+        self._flush()
+        chunks = []
+        while self._index < len(self._parts) and size != 0:
+            part = self._parts[self._index]
+            part_size = self._part_size(part)
+            remaining = part_size - self._part_pos
+            if size < 0 or size > remaining:
+                n = remaining
+            else:
+                n = size
+            if isinstance(part, str):
+                chunk = part[self._part_pos:self._part_pos+n]
+            else:
+                file_object, offset = part[:2]
+                file_object.seek(offset + self._part_pos)
+                chunk = file_object.read(n)
+                if len(chunk) != n:
+                    raise IOError("uploaded file changed size while "
+                                  "being sent")
+            chunks.append(chunk)
+            self._part_pos += n
+            if size > 0:
+                size -= n
+            if self._part_pos == part_size:
+                self._index += 1
+                self._part_pos = 0
+        return "".join(chunks)
+
+
 class LocateError(ValueError): pass
 class AmbiguityError(LocateError): pass
 class ControlNotFoundError(LocateError): pass
@@ -1338,7 +1462,7 @@ class FileControl(ScalarControl):
             disp = 'form-data; name="%s"%s' % (self.name, fn_part)
             mw2.addheader("Content-Disposition", disp, prefix=1)
             fh = mw2.startbody(content_type, prefix=0)
-            fh.write(file_object.read())
+            fh.write_file(file_object)
         else:
             # multiple files
             for file_object, content_type, filename in self._upload_data:
@@ -1349,7 +1473,7 @@ class FileControl(ScalarControl):
                 disp = 'form-data; name="%s"%s' % (self.name, fn_part)
                 mw2.addheader("Content-Disposition", disp, prefix=1)
                 fh = mw2.startbody(content_type, prefix=0)
-                fh.write(file_object.read())
+                fh.write_file(file_object)
 
 
     def __str__(self):
@@ -3005,6 +3129,10 @@ class HTMLForm:
         if you're using httplib or urllib rather than mechanize.  Otherwise,
         use the click method.
 
+        For multipart/form-data forms, data is a file-like MultipartBody
+        rather than a string, so that uploaded files aren't read into memory
+        up front.  Use data.read() if you need the whole body as a string.
+
         # Untested.  Have to subclass to add headers, I think -- so use
         # mechanize instead!
         import urllib
@@ -3239,7 +3367,7 @@ class HTMLForm:
                 return (uri, urllib.urlencode(self._pairs()),
                         [("Content-Type", self.enctype)])
             elif self.enctype == "multipart/form-data":
-                data = StringIO()
+                data = MultipartBody()
                 http_hdrs = []
                 mw = MimeWriter(data, http_hdrs)
                 mw.startmultipartbody("form-data", add_to_http_hdrs=True,
@@ -3247,7 +3375,7 @@ class HTMLForm:
                 for ii, k, v, control_index in self._pairs_and_controls():
                     self.controls[control_index]._write_mime_data(mw, k, v)
                 mw.lastpart()
-                return uri, data.getvalue(), http_hdrs
+                return uri, data, http_hdrs
             else:
                 raise ValueError(
                     "unknown POST form encoding type '%s'" % self.enctype)
@@ -1,105 +1,164 @@
-from cStringIO import StringIO
+import copy
+import zlib
 
 import _response
 import _urllib2_fork
 
 
-# GzipConsumer was taken from Fredrik Lundh's effbot.org-0.1-20041009 library
-class GzipConsumer:
+# amount of compressed data read from the wrapped response at a time
+CHUNK_SIZE = 16*1024
 
-    def __init__(self, consumer):
-        self.__consumer = consumer
-        self.__decoder = None
-        self.__data = ""
 
-    def __getattr__(self, key):
-        return getattr(self.__consumer, key)
+class ZlibDecodingFile:
+    """File-like object that decompresses the body of a response as it is read.
 
-    def feed(self, data):
-        if self.__decoder is None:
-            # check if we have a full gzip header
-            data = self.__data + data
+    wbits is passed to zlib.decompressobj(): 16+zlib.MAX_WBITS for gzip,
+    zlib.MAX_WBITS for deflate.  Since some servers send deflate data without
+    the zlib header, for deflate a raw stream is accepted too.
+
+    Only as much of the body is read and decompressed as is needed to satisfy
+    each .read() or .readline().
+    """
+
+    def __init__(self, fp, wbits):
+        self._fp = fp
+        self._wbits = wbits
+        self._decoder = zlib.decompressobj(wbits)
+        self._started = False
+        self._eof = False
+        self._buf = ""  # decompressed data not returned yet
+
+    def _decode(self):
+        # decompress the next chunk of the body
+        data = self._fp.read(CHUNK_SIZE)
+        started, self._started = self._started, True
+        try:
+            if not data:
+                self._eof = True
+                return self._decoder.flush()
             try:
-                i = 10
-                flag = ord(data[3])
-                if flag & 4: # extra
-                    x = ord(data[i]) + 256*ord(data[i+1])
-                    i = i + 2 + x
-                if flag & 8: # filename
-                    while ord(data[i]):
-                        i = i + 1
-                    i = i + 1
-                if flag & 16: # comment
-                    while ord(data[i]):
-                        i = i + 1
-                    i = i + 1
-                if flag & 2: # crc
-                    i = i + 2
-                if len(data) < i:
-                    raise IndexError("not enough data")
-                if data[:3] != "\x1f\x8b\x08":
-                    raise IOError("invalid gzip data")
-                data = data[i:]
-            except IndexError:
-                self.__data = data
-                return # need more data
-            import zlib
-            self.__data = ""
-            self.__decoder = zlib.decompressobj(-zlib.MAX_WBITS)
-        data = self.__decoder.decompress(data)
-        if data:
-            self.__consumer.feed(data)
+                return self._decoder.decompress(data)
+            except zlib.error:
+                if started or self._wbits != zlib.MAX_WBITS:
+                    raise
+                # deflate without the zlib header
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+                return self._decoder.decompress(data)
+        except zlib.error, exc:
+            raise IOError("invalid compressed data: %s" % exc)
 
-    def close(self):
-        if self.__decoder:
-            data = self.__decoder.flush()
-            if data:
-                self.__consumer.feed(data)
-        self.__consumer.close()
+    def read(self, size=-1):
+        chunks = [self._buf]
+        n = len(self._buf)
+        while (size < 0 or n < size) and not self._eof:
+            data = self._decode()
+            chunks.append(data)
+            n += len(data)
+        data = "".join(chunks)
+        if size < 0 or size >= len(data):
+            self._buf = ""
+            return data
+        self._buf = data[size:]
+        return data[:size]
 
+    def readline(self, size=-1):
+        chunks = [self._buf]
+        n = len(self._buf)
+        end = self._buf.find("\n") + 1
+        while not end and (size < 0 or n < size) and not self._eof:
+            data = self._decode()
+            i = data.find("\n")
+            if i != -1:
+                end = n + i + 1
+            chunks.append(data)
+            n += len(data)
+        data = "".join(chunks)
+        if not end:
+            end = len(data)
+        if size >= 0 and size < end:
+            end = size
+        self._buf = data[end:]
+        return data[:end]
 
-# --------------------------------------------------------------------
+    def readlines(self, sizehint=-1):
+        lines = []
+        total = 0
+        while 1:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+            total += len(line)
+            if 0 < sizehint <= total:
+                break
+        return lines
+
+    def __iter__(self): return self
+    def next(self):
+        line = self.readline()
+        if line == "": raise StopIteration
+        return line
 
-# the rest of this module is John Lee's stupid code, not
-# Fredrik's nice code :-)
+    def close(self):
+        self._fp.close()
 
-class stupid_gzip_consumer:
-    def __init__(self): self.data = []
-    def feed(self, data): self.data.append(data)
 
-class stupid_gzip_wrapper(_response.closeable_response):
-    def __init__(self, response):
-        self._response = response
+def _decoded_headers(headers):
+    # a copy of the headers without the ones describing the encoded body:
+    # the body is no longer encoded, and its decoded length isn't known
+    if not (hasattr(headers, "dict") and hasattr(headers, "headers")):
+        return headers
+    headers = copy.copy(headers)
+    headers.dict = headers.dict.copy()
+    headers.headers = list(headers.headers)
+    for name in ("content-encoding", "content-length"):
+        if name in headers:
+            del headers[name]
+    return headers
 
-        c = stupid_gzip_consumer()
-        gzc = GzipConsumer(c)
-        gzc.feed(response.read())
-        self.__data = StringIO("".join(c.data))
+class decoded_response(_response.closeable_response):
+    """Response with a decompressed body; other attributes are delegated.
 
-    def read(self, size=-1):
-        return self.__data.read(size)
-    def readline(self, size=-1):
-        return self.__data.readline(size)
-    def readlines(self, sizehint=-1):
-        return self.__data.readlines(sizehint)
+    .info() has no Content-Encoding or Content-Length header.
+    """
+
+    def __init__(self, response, wbits):
+        self._response = response
+        _response.closeable_response.__init__(
+            self, ZlibDecodingFile(response, wbits),
+            _decoded_headers(response.info()),
+            response.geturl(), getattr(response, "code", None),
+            getattr(response, "msg", None))
 
     def __getattr__(self, name):
         # delegate unknown methods/attributes
         return getattr(self._response, name)
 
+
+_WBITS = {
+    "gzip": 16+zlib.MAX_WBITS,
+    "x-gzip": 16+zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+    }
+
 class HTTPGzipProcessor(_urllib2_fork.BaseHandler):
+    """Ask for gzip or deflate compressed responses, and decompress them."""
+
     handler_order = 200  # response processing before HTTPEquivProcessor
 
     def http_request(self, request):
-        request.add_header("Accept-Encoding", "gzip")
+        if not request.has_header("Accept-encoding"):
+            request.add_unredirected_header("Accept-encoding", "gzip, deflate")
         return request
 
     def http_response(self, request, response):
         # post-process response
         enc_hdrs = response.info().getheaders("Content-encoding")
         for enc_hdr in enc_hdrs:
-            if ("gzip" in enc_hdr) or ("compress" in enc_hdr):
-                return stupid_gzip_wrapper(response)
+            wbits = _WBITS.get(enc_hdr.strip().lower())
+            if wbits is not None:
+                return decoded_response(response, wbits)
         return response
 
+    https_request = http_request
     https_response = http_response
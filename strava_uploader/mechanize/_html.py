@@ -10,13 +10,11 @@ included with the distribution).
 
 import codecs
 import copy
-import htmlentitydefs
 import re
+from cStringIO import StringIO
 
 import _sgmllib_copy as sgmllib
 
-import _beautifulsoup
-import _form
 from _headersutil import split_header_words, is_html as _is_html
 import _request
 import _rfc3986
@@ -25,6 +23,32 @@ DEFAULT_ENCODING = "latin-1"
 
 COMPRESS_RE = re.compile(r"\s+")
 
+# for FormsFactory.find_form()
+_TAG_ATTRS = r"""((?:[^>"']|"[^"]*"|'[^']*')*)>"""
+FORM_START_RE = re.compile(r"<form(?=[\s>/])" + _TAG_ATTRS, re.I)
+FORM_END_RE = re.compile(r"</form\s*>", re.I)
+BASE_RE = re.compile(r"<base(?=[\s>/])" + _TAG_ATTRS, re.I)
+# sections where tags found by the regexps above may not be what the parser
+# sees: it ignores comments, and may not parse scripts and styles the same
+OPAQUE_RE = re.compile(
+    r"<!--.*?(?:-->|\Z)|<(script|style)(?=[\s>/]).*?(?:</\1\s*>|\Z)",
+    re.I | re.S)
+ATTR_RE = re.compile(
+    r"""([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+
+
+class ResponseBody(object):
+    """Body of a response, read the first time it is needed."""
+
+    def __init__(self, response):
+        self._response = response
+        self._data = None
+
+    def get(self):
+        if self._data is None:
+            self._data = copy.copy(self._response).read()
+        return self._data
+
 
 class CachingGeneratorFunction(object):
     """Caching wrapper around a no-arguments iterable."""
@@ -102,6 +126,23 @@ def form_parser_args(
     return Args(locals())
 
 
+class LazyTokenStream(object):
+    """Makes a _pullparser.TokenStream when the first parser is asked for,
+    so that _pullparser isn't imported for responses nobody looks into."""
+
+    def __init__(self, get_data, encoding):
+        self._get_data = get_data
+        self._encoding = encoding
+        self._stream = None
+
+    def parser(self):
+        if self._stream is None:
+            import _pullparser
+            self._stream = _pullparser.TokenStream(
+                self._get_data, encoding=self._encoding)
+        return self._stream.parser()
+
+
 class Link:
     def __init__(self, base_url, url, text, tag, attrs):
         assert None not in [url, tag, attrs]
@@ -128,9 +169,8 @@ class LinksFactory:
                  link_class=Link,
                  urltags=None,
                  ):
-        import _pullparser
-        if link_parser_class is None:
-            link_parser_class = _pullparser.TolerantPullParser
+        # None means _pullparser.TolerantPullParser, which is imported when
+        # links are first asked for
         self.link_parser_class = link_parser_class
         self.link_class = link_class
         if urltags is None:
@@ -143,18 +183,30 @@ class LinksFactory:
         self.urltags = urltags
         self._response = None
         self._encoding = None
+        self._tokens = None
 
-    def set_response(self, response, base_url, encoding):
+    def set_response(self, response, base_url, encoding, tokens=None):
+        """tokens, if given, is a _pullparser.TokenStream (or LazyTokenStream)
+        of the response, which is used instead of parsing the response
+        again."""
         self._response = response
         self._encoding = encoding
         self._base_url = base_url
+        self._tokens = tokens
 
     def links(self):
         """Return an iterator that provides links of the document."""
         response = self._response
         encoding = self._encoding
         base_url = self._base_url
-        p = self.link_parser_class(response, encoding=encoding)
+        if self._tokens is not None:
+            p = self._tokens.parser()
+        else:
+            link_parser_class = self.link_parser_class
+            if link_parser_class is None:
+                import _pullparser
+                link_parser_class = _pullparser.TolerantPullParser
+            p = link_parser_class(response, encoding=encoding)
 
         try:
             for token in p.tags(*(self.urltags.keys()+["base"])):
@@ -189,6 +241,7 @@ class LinksFactory:
 
                 yield Link(base_url, url, text, tag, token.attrs)
         except sgmllib.SGMLParseError, exc:
+            import _form
             raise _form.ParseError(exc)
 
 class FormsFactory:
@@ -208,29 +261,37 @@ class FormsFactory:
                  backwards_compat=False,
                  ):
         self.select_default = select_default
-        if form_parser_class is None:
-            form_parser_class = _form.FormParser
+        # None means _form.FormParser; _form is imported when forms are
+        # first asked for
         self.form_parser_class = form_parser_class
         if request_class is None:
             request_class = _request.Request
         self.request_class = request_class
         self.backwards_compat = backwards_compat
         self._response = None
+        self._get_data = None
         self.encoding = None
         self.global_form = None
 
-    def set_response(self, response, encoding):
+    def set_response(self, response, encoding, get_data=None):
+        """get_data, if given, is a function returning the body of the
+        response, which is then not read from the response again."""
         self._response = response
+        if get_data is None:
+            get_data = ResponseBody(response).get
+        self._get_data = get_data
         self.encoding = encoding
         self.global_form = None
 
     def forms(self):
+        import _form
         encoding = self.encoding
-        forms = _form.ParseResponseEx(
-            self._response,
+        forms = _form._ParseFileEx(
+            StringIO(self._get_data()), self._response.geturl(),
             select_default=self.select_default,
-            form_parser_class=self.form_parser_class,
+            form_parser_class=self.form_parser_class or _form.FormParser,
             request_class=self.request_class,
+            backwards_compat=False,
             encoding=encoding,
             _urljoin=_rfc3986.urljoin,
             _urlparse=_rfc3986.urlsplit,
@@ -239,13 +300,86 @@ class FormsFactory:
         self.global_form = forms[0]
         return forms[1:]
 
+    def find_form(self, attrs):
+        """Return the first form whose attributes include attrs, or None.
+
+        Rather than parsing the whole document, FORM start tags are scanned
+        for one with matching attributes, and only that form is parsed.  If
+        the tags found are in a comment, script or style, the whole document
+        is parsed after all.
+        """
+        import _form
+        data = self._get_data()
+        entitydefs = _form.get_entitydefs()
+
+        for match in FORM_START_RE.finditer(data):
+            form_attrs = {}
+            for name, dq, sq, bare in ATTR_RE.findall(match.group(1)):
+                value = _form.unescape(dq or sq or bare, entitydefs,
+                                       self.encoding)
+                form_attrs.setdefault(name.lower(), value)
+            for name, value in attrs.iteritems():
+                if form_attrs.get(name) != value:
+                    break
+            else:
+                break
+        else:
+            return None
+
+        # forms can't be nested, so the form ends at the first end tag
+        end = FORM_END_RE.search(data, match.end())
+        if end is None:
+            html = data[match.start():]
+        else:
+            html = data[match.start():end.end()]
+        # keep the BASE element, which takes precedence over the document URI
+        base = BASE_RE.search(data, 0, match.start())
+        if base is not None:
+            html = base.group() + html
+
+        stop = len(data) if end is None else end.end()
+        for opaque in OPAQUE_RE.finditer(data, 0, stop):
+            if opaque.end() > match.start() or (
+                base is not None and opaque.end() > base.start() and
+                opaque.start() < base.end()):
+                return self._find_parsed_form(attrs)
+
+        forms = _form._ParseFileEx(
+            StringIO(html), self._response.geturl(),
+            select_default=self.select_default,
+            form_parser_class=self.form_parser_class or _form.FormParser,
+            request_class=self.request_class,
+            backwards_compat=False,
+            encoding=self.encoding,
+            _urljoin=_rfc3986.urljoin,
+            _urlparse=_rfc3986.urlsplit,
+            _urlunparse=_rfc3986.urlunsplit,
+            )
+        if len(forms) < 2:
+            return None
+        return forms[1]
+
+    def _find_parsed_form(self, attrs):
+        for form in self.forms():
+            for name, value in attrs.iteritems():
+                if form.attrs.get(name) != value:
+                    break
+            else:
+                return form
+        return None
+
 class TitleFactory:
     def __init__(self):
         self._response = self._encoding = None
+        self._tokens = None
 
-    def set_response(self, response, encoding):
+    def set_response(self, response, encoding, tokens=None):
+        """tokens, if given, is a _pullparser.TokenStream (or LazyTokenStream)
+        of the response, which is used instead of parsing the response
+        again."""
         self._response = response
         self._encoding = encoding
+        self._tokens = tokens
 
     def _get_title_text(self, parser):
         import _pullparser
@@ -274,8 +408,11 @@ class TitleFactory:
 
     def title(self):
         import _pullparser
-        p = _pullparser.TolerantPullParser(
-            self._response, encoding=self._encoding)
+        if self._tokens is not None:
+            p = self._tokens.parser()
+        else:
+            p = _pullparser.TolerantPullParser(
+                self._response, encoding=self._encoding)
         try:
             try:
                 p.get_tag("title")
@@ -284,6 +421,7 @@ class TitleFactory:
             else:
                 return self._get_title_text(p)
         except sgmllib.SGMLParseError, exc:
+            import _form
             raise _form.ParseError(exc)
 
 
@@ -325,34 +463,6 @@ def unescape_charref(data, encoding):
         return repl
 
 
-class MechanizeBs(_beautifulsoup.BeautifulSoup):
-    _entitydefs = htmlentitydefs.name2codepoint
-    # don't want the magic Microsoft-char workaround
-    PARSER_MASSAGE = [(re.compile('(<[^<>]*)/>'),
-                       lambda(x):x.group(1) + ' />'),
-                      (re.compile('<!\s+([^<>]*)>'),
-                       lambda(x):'<!' + x.group(1) + '>')
-                      ]
-
-    def __init__(self, encoding, text=None, avoidParserProblems=True,
-                 initialTextIsEverything=True):
-        self._encoding = encoding
-        _beautifulsoup.BeautifulSoup.__init__(
-            self, text, avoidParserProblems, initialTextIsEverything)
-
-    def handle_charref(self, ref):
-        t = unescape("&#%s;"%ref, self._entitydefs, self._encoding)
-        self.handle_data(t)
-    def handle_entityref(self, ref):
-        t = unescape("&%s;"%ref, self._entitydefs, self._encoding)
-        self.handle_data(t)
-    def unescape_attrs(self, attrs):
-        escaped_attrs = []
-        for key, val in attrs:
-            val = unescape(val, self._entitydefs, self._encoding)
-            escaped_attrs.append((key, val))
-        return escaped_attrs
-
 class RobustLinksFactory:
 
     compress_re = COMPRESS_RE
@@ -363,7 +473,7 @@ class RobustLinksFactory:
                  urltags=None,
                  ):
         if link_parser_class is None:
-            link_parser_class = MechanizeBs
+            from _mechanizebs import MechanizeBs as link_parser_class
         self.link_parser_class = link_parser_class
         self.link_class = link_class
         if urltags is None:
@@ -384,6 +494,7 @@ class RobustLinksFactory:
         self._encoding = encoding
 
     def links(self):
+        import _beautifulsoup
         bs = self._bs
         base_url = self._base_url
         encoding = self._encoding
@@ -419,12 +530,12 @@ class RobustFormsFactory(FormsFactory):
     def __init__(self, *args, **kwds):
         args = form_parser_args(*args, **kwds)
         if args.form_parser_class is None:
+            import _form
             args.form_parser_class = _form.RobustFormParser
         FormsFactory.__init__(self, **args.dictionary)
 
     def set_response(self, response, encoding):
-        self._response = response
-        self.encoding = encoding
+        FormsFactory.set_response(self, response, encoding)
 
 
 class RobustTitleFactory:
@@ -436,6 +547,7 @@ class RobustTitleFactory:
         self._encoding = encoding
 
     def title(self):
+        import _beautifulsoup
         title = self._bs.first("title")
         if title == _beautifulsoup.Null:
             return None
@@ -454,6 +566,7 @@ class Factory:
     set_request_class(request_class)
     set_response(response)
     forms()
+    find_form(attrs)
     links()
 
     Public attributes:
@@ -562,6 +675,24 @@ class Factory:
                 self._forms_factory, "global_form", None)
         return self._forms_genf()
 
+    def find_form(self, attrs):
+        """Return the first form whose attributes include attrs, or None.
+
+        Unless the forms have already been parsed, only the matching form is
+        parsed.  attrs is a dictionary mapping attribute names to values.
+
+        Raises mechanize.ParseError on failure.
+        """
+        if self._forms_genf is not None:
+            for form in self._forms_genf():
+                for name, value in attrs.iteritems():
+                    if form.attrs.get(name) != value:
+                        break
+                else:
+                    return form
+            return None
+        return self._forms_factory.find_form(attrs)
+
     def links(self):
         """Return iterable over mechanize.Link-like objects.
 
@@ -577,7 +708,11 @@ class Factory:
         return self._links_genf()
 
 class DefaultFactory(Factory):
-    """Based on sgmllib."""
+    """Based on sgmllib.
+
+    The response is read once.  Links and the title are found from a single
+    tokenization of it, made as they are asked for.
+    """
     def __init__(self, i_want_broken_xhtml_support=False):
         Factory.__init__(
             self,
@@ -591,12 +726,13 @@ class DefaultFactory(Factory):
     def set_response(self, response):
         Factory.set_response(self, response)
         if response is not None:
+            get_data = ResponseBody(response).get
+            tokens = LazyTokenStream(get_data, encoding=self.encoding)
             self._forms_factory.set_response(
-                copy.copy(response), self.encoding)
+                response, self.encoding, get_data)
             self._links_factory.set_response(
-                copy.copy(response), response.geturl(), self.encoding)
-            self._title_factory.set_response(
-                copy.copy(response), self.encoding)
+                response, response.geturl(), self.encoding, tokens)
+            self._title_factory.set_response(response, self.encoding, tokens)
 
 class RobustFactory(Factory):
     """Based on BeautifulSoup, hopefully a bit more robust to bad HTML than is
@@ -614,7 +750,7 @@ class RobustFactory(Factory):
                 allow_xhtml=i_want_broken_xhtml_support),
             )
         if soup_class is None:
-            soup_class = MechanizeBs
+            from _mechanizebs import MechanizeBs as soup_class
         self._soup_class = soup_class
 
     def set_response(self, response):
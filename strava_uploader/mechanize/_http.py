@@ -16,9 +16,19 @@ import HTMLParser
 from cStringIO import StringIO
 import htmlentitydefs
 import logging
+import os
 import robotparser
 import socket
+import sys
 import time
+try:
+    import json
+except ImportError:
+    json = None
+try:
+    import threading as _threading
+except ImportError:
+    import dummy_threading as _threading
 
 import _sgmllib_copy as sgmllib
 from _urllib2_fork import HTTPError, BaseHandler
@@ -189,12 +199,15 @@ class HTTPEquivProcessor(BaseHandler):
         self._allow_xhtml = i_want_broken_xhtml_support
 
     def http_response(self, request, response):
-        if not hasattr(response, "seek"):
-            response = response_seek_wrapper(response)
         http_message = response.info()
         url = response.geturl()
         ct_hdrs = http_message.getheaders("content-type")
         if is_html(ct_hdrs, url, self._allow_xhtml):
+            # only HTML needs to be seekable here, so that other responses
+            # (e.g. JSON) can be read straight from the connection
+            if not hasattr(response, "seek"):
+                response = response_seek_wrapper(response)
+                http_message = response.info()
             try:
                 try:
                     html_headers = parse_head(response,
@@ -233,7 +246,17 @@ class MechanizeRobotFileParser(robotparser.RobotFileParser):
         self._timeout = timeout
 
     def read(self):
-        """Reads the robots.txt URL and feeds it to the parser."""
+        """Reads the robots.txt URL and feeds it to the parser.
+
+        Afterwards, .robots_txt is the (HTTP status, lines) that was read, or
+        None if robots.txt could not be fetched.
+        """
+        self.robots_txt = self.fetch()
+        if self.robots_txt is not None:
+            self.feed(*self.robots_txt)
+
+    def fetch(self):
+        """Return (HTTP status, lines) of the robots.txt URL, or None."""
         if self._opener is None:
             self.set_opener()
         req = Request(self.url, unverifiable=True, visit=False,
@@ -245,13 +268,19 @@ class MechanizeRobotFileParser(robotparser.RobotFileParser):
         except (IOError, socket.error, OSError), exc:
             debug_robots("ignoring error opening %r: %s" %
                                (self.url, exc))
-            return
+            return None
         lines = []
-        line = f.readline()
-        while line:
-            lines.append(line.strip())
+        try:
             line = f.readline()
-        status = f.code
+            while line:
+                lines.append(line.strip())
+                line = f.readline()
+        finally:
+            f.close()
+        return f.code, lines
+
+    def feed(self, status, lines):
+        """Set the rules from the HTTP status and lines of robots.txt."""
         if status == 401 or status == 403:
             self.disallow_all = True
             debug_robots("disallow all")
@@ -262,6 +291,168 @@ class MechanizeRobotFileParser(robotparser.RobotFileParser):
             debug_robots("parse lines")
             self.parse(lines)
 
+class RobotRulesCache:
+    """robots.txt rules, shared by the HTTPRobotRulesProcessors using it.
+
+    robots.txt is fetched once per host and its rules are kept for ttl
+    seconds.  After that the old rules are still used while robots.txt is
+    fetched again in a background thread, so only the first request ever
+    made to a host waits for robots.txt.
+
+    filename: if given, rules are also saved to this file (as JSON) and
+     loaded from it, so they are kept between runs.
+
+    """
+
+    def __init__(self, filename=None, ttl=24*60*60,
+                 rfp_class=MechanizeRobotFileParser):
+        self.filename = filename
+        self.ttl = ttl
+        self.rfp_class = rfp_class
+        self._lock = _threading.Lock()
+        # robots.txt URL -> (time fetched, (status, lines) or None, parser)
+        self._rules = {}
+        self._refreshing = set()
+        if filename is not None:
+            self._load()
+
+    def get(self, url, opener, timeout=_sockettimeout._GLOBAL_DEFAULT_TIMEOUT):
+        """Return a robot file parser for robots.txt URL url.
+
+        opener is used if robots.txt has to be fetched before returning.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._rules.get(url)
+            if entry is not None:
+                fetched, robots_txt, rfp = entry
+                if (time.time() - fetched > self.ttl and
+                    url not in self._refreshing):
+                    self._refreshing.add(url)
+                    thread = _threading.Thread(
+                        target=self._refresh, args=(url, timeout))
+                    thread.setDaemon(True)
+                    thread.start()
+                return rfp
+        finally:
+            self._lock.release()
+
+        rfp = self._read(url, opener, timeout)
+        self._store(url, rfp)
+        return rfp
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._rules.clear()
+        finally:
+            self._lock.release()
+        self._save()
+
+    def _read(self, url, opener, timeout):
+        rfp = self.rfp_class()
+        try:
+            rfp.set_opener(opener)
+        except AttributeError:
+            debug("%r instance does not support set_opener" %
+                  rfp.__class__)
+        rfp.set_url(url)
+        rfp.set_timeout(timeout)
+        rfp.read()
+        # don't keep the opener (and its Browser) alive in the cache
+        if hasattr(rfp, "_opener"):
+            rfp._opener = None
+        return rfp
+
+    def _refresh(self, url, timeout):
+        # runs in a thread of its own, so uses an opener of its own
+        import _opener
+        try:
+            rfp = self._read(url, _opener.build_opener(), timeout)
+            self._store(url, rfp)
+        finally:
+            self._lock.acquire()
+            try:
+                self._refreshing.discard(url)
+            finally:
+                self._lock.release()
+
+    def _store(self, url, rfp):
+        robots_txt = getattr(rfp, "robots_txt", None)
+        if robots_txt is None:
+            # not fetched: try again next time
+            return
+        self._lock.acquire()
+        try:
+            self._rules[url] = (time.time(), robots_txt, rfp)
+        finally:
+            self._lock.release()
+        self._save()
+
+    def _load(self):
+        if json is None:
+            return
+        try:
+            f = open(self.filename, "rb")
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError), exc:
+            debug_robots("not loading robots.txt rules: %s" % exc)
+            return
+        try:
+            for url, (fetched, status, lines) in data.iteritems():
+                url = url.encode("latin-1")
+                lines = [line.encode("latin-1") for line in lines]
+                rfp = self.rfp_class()
+                rfp.set_url(url)
+                rfp.robots_txt = status, lines
+                rfp.feed(status, lines)
+                self._rules[url] = (fetched, (status, lines), rfp)
+        except (TypeError, ValueError, AttributeError), exc:
+            debug_robots("not loading robots.txt rules: %s" % exc)
+
+    def _save(self):
+        if self.filename is None or json is None:
+            return
+        self._lock.acquire()
+        try:
+            data = {}
+            for url, (fetched, (status, lines), rfp) in self._rules.items():
+                # robots.txt isn't necessarily UTF-8: keep the bytes
+                data[url.decode("latin-1")] = (
+                    fetched, status, [line.decode("latin-1") for line in lines])
+            tmp_filename = self.filename + ".tmp"
+            try:
+                f = open(tmp_filename, "wb")
+                try:
+                    json.dump(data, f)
+                finally:
+                    f.close()
+                if sys.platform == "win32" and os.path.exists(self.filename):
+                    os.remove(self.filename)
+                os.rename(tmp_filename, self.filename)
+            except (IOError, OSError), exc:
+                debug_robots("not saving robots.txt rules: %s" % exc)
+        finally:
+            self._lock.release()
+
+# shared by HTTPRobotRulesProcessors not given a cache of their own
+_default_robot_rules_cache = None
+_default_robot_rules_cache_lock = _threading.Lock()
+
+def default_robot_rules_cache():
+    global _default_robot_rules_cache
+    _default_robot_rules_cache_lock.acquire()
+    try:
+        if _default_robot_rules_cache is None:
+            _default_robot_rules_cache = RobotRulesCache()
+        return _default_robot_rules_cache
+    finally:
+        _default_robot_rules_cache_lock.release()
+
+
 class RobotExclusionError(HTTPError):
     def __init__(self, request, *args):
         apply(HTTPError.__init__, (self,)+args)
@@ -279,8 +470,19 @@ class HTTPRobotRulesProcessor(BaseHandler):
     else:
         http_response_class = HTTPMessage
 
-    def __init__(self, rfp_class=MechanizeRobotFileParser):
+    def __init__(self, rfp_class=MechanizeRobotFileParser, cache=None):
+        """
+        cache: RobotRulesCache to keep robots.txt rules in.  By default, a
+         cache shared by all processors (in memory only) is used.
+
+        """
         self.rfp_class = rfp_class
+        if cache is None:
+            if rfp_class is MechanizeRobotFileParser:
+                cache = default_robot_rules_cache()
+            else:
+                cache = RobotRulesCache(rfp_class=rfp_class)
+        self.cache = cache
         self.rfp = None
         self._host = None
 
@@ -304,17 +506,9 @@ class HTTPRobotRulesProcessor(BaseHandler):
             ):
             return request
 
-        if host != self._host:
-            self.rfp = self.rfp_class()
-            try:
-                self.rfp.set_opener(self.parent)
-            except AttributeError:
-                debug("%r instance does not support set_opener" %
-                      self.rfp.__class__)
-            self.rfp.set_url(scheme+"://"+host+"/robots.txt")
-            self.rfp.set_timeout(request.timeout)
-            self.rfp.read()
-            self._host = host
+        self.rfp = self.cache.get(scheme+"://"+host+"/robots.txt",
+                                  self.parent, request.timeout)
+        self._host = host
 
         ua = request.get_header("User-agent", "")
         if self.rfp.can_fetch(ua, request.get_full_url()):
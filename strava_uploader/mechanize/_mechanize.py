@@ -32,6 +32,13 @@ def sanepathname2url(path):
     return urlpath
 
 
+def _form_has_attrs(form, attrs):
+    for name, value in attrs.iteritems():
+        if form.attrs.get(name) != value:
+            return False
+    return True
+
+
 class History:
     """
 
@@ -99,6 +106,7 @@ class Browser(UserAgentBase):
                  factory=None,
                  history=None,
                  request_class=None,
+                 profile="default",
                  ):
         """
 
@@ -108,6 +116,8 @@ class Browser(UserAgentBase):
         history: object implementing the mechanize.History interface.  Note
          this interface is still experimental and may change in future.
         request_class: Request class to use.  Defaults to mechanize.Request
+        profile: "default", or "minimal" for a Browser with only the handlers
+         needed for API-style use (see UserAgentBase.__init__)
 
         The Factory and History objects passed in are 'owned' by the Browser,
         so they should not be shared across Browsers.  In particular,
@@ -137,7 +147,7 @@ class Browser(UserAgentBase):
         self._set_response(None, False)
 
         # do this last to avoid __getattr__ problems
-        UserAgentBase.__init__(self)
+        UserAgentBase.__init__(self, profile)
 
     def close(self):
         UserAgentBase.close(self)
@@ -459,7 +469,7 @@ class Browser(UserAgentBase):
             raise BrowserStateError("not viewing HTML")
         return self._factory.title
 
-    def select_form(self, name=None, predicate=None, nr=None):
+    def select_form(self, name=None, predicate=None, nr=None, **attrs):
         """Select an HTML form for input.
 
         This is a bit like giving a form the "input focus" in a browser.
@@ -472,8 +482,9 @@ class Browser(UserAgentBase):
         form assigned should be one of the objects returned by the .forms()
         method.
 
-        At least one of the name, predicate and nr arguments must be supplied.
-        If no matching form is found, mechanize.FormNotFoundError is raised.
+        At least one of the name, predicate, nr and attribute arguments must be
+        supplied.  If no matching form is found, mechanize.FormNotFoundError is
+        raised.
 
         If name is specified, then the form must have the indicated name.
 
@@ -489,13 +500,28 @@ class Browser(UserAgentBase):
         to have no name, so will not be matched unless both name and nr are
         None.
 
+        Any other keyword arguments are HTML attributes that the form must
+        have, with the given values, e.g. select_form(id="login_form").  If
+        only attributes are given, the page is scanned for the first matching
+        form, and only that form is parsed.
+
         """
         if not self.viewing_html():
             raise BrowserStateError("not viewing HTML")
-        if (name is None) and (predicate is None) and (nr is None):
+        if (name is None) and (predicate is None) and (nr is None) and \
+               not attrs:
             raise ValueError(
                 "at least one argument must be supplied to specify form")
 
+        if attrs and name is None and predicate is None and nr is None and \
+               hasattr(self._factory, "find_form"):
+            form = self._factory.find_form(attrs)
+            if form is None:
+                raise FormNotFoundError(
+                    "no form matching attributes %s" % attrs)
+            self.form = form
+            return
+
         global_form = self._factory.global_form
         if nr is None and name is None and \
                predicate is not None and predicate(global_form):
@@ -508,6 +534,8 @@ class Browser(UserAgentBase):
                 continue
             if predicate is not None and not predicate(form):
                 continue
+            if not _form_has_attrs(form, attrs):
+                continue
             if nr:
                 nr -= 1
                 continue
@@ -519,6 +547,7 @@ class Browser(UserAgentBase):
             if name is not None: description.append("name '%s'" % name)
             if predicate is not None:
                 description.append("predicate %s" % predicate)
+            if attrs: description.append("attributes %s" % attrs)
             if orig_nr is not None: description.append("nr %d" % orig_nr)
             description = ", ".join(description)
             raise FormNotFoundError("no form matching "+description)
@@ -35,6 +35,79 @@ class ContentTooShortError(urllib2.URLError):
         self.result = result
 
 
+# dispatch methods of each handler class: {class: [(lookup, scheme, kind,
+# method name)]}; shared by all openers, so the dir() calls and method name
+# parsing happen once per handler class
+_class_dispatch = {}
+_class_dispatch_lock = _threading.Lock()
+
+def _parse_dispatch_name(meth):
+    # -> (lookup, scheme, kind) for a method name OpenerDirector dispatches
+    # to, or None
+    if meth in ["redirect_request", "do_open", "proxy_open"]:
+        # oops, coincidental match
+        return None
+    if meth == "any_request" or meth == "any_response":
+        return meth, None, None
+
+    ii = meth.find("_")
+    scheme = meth[:ii]
+    condition = meth[ii+1:]
+
+    if condition.startswith("error"):
+        jj = meth[ii+1:].find("_") + ii + 1
+        kind = meth[jj+1:]
+        try:
+            kind = int(kind)
+        except ValueError:
+            pass
+        return "error", scheme, kind
+    elif condition in ("open", "request", "response"):
+        return condition, scheme, scheme
+    return None
+
+def _parse_dispatch_names(names):
+    methods = []
+    for meth in names:
+        parsed = _parse_dispatch_name(meth)
+        if parsed is not None:
+            methods.append(parsed + (meth,))
+    return methods
+
+def handler_dispatch_methods(handler):
+    """Return [(lookup, scheme, kind, method name)] for handler.
+
+    lookup is one of "open", "request", "response", "error", "any_request"
+    or "any_response".
+    """
+    klass = handler.__class__
+    _class_dispatch_lock.acquire()
+    try:
+        methods = _class_dispatch.get(klass)
+        if methods is None:
+            methods = _class_dispatch[klass] = _parse_dispatch_names(
+                dir(klass))
+    finally:
+        _class_dispatch_lock.release()
+    # some handlers (ProxyHandler) add methods per instance
+    extra = getattr(handler, "__dict__", None)
+    if extra:
+        methods = methods + _parse_dispatch_names(extra.keys())
+    return methods
+
+
+def call_chain(chain, args):
+    """Call the bound methods in chain in turn, until one returns a result.
+
+    Like _urllib2_fork.OpenerDirector._call_chain, for compiled chains.
+    """
+    for meth in chain:
+        result = meth(*args)
+        if result is not None:
+            return result
+    return None
+
+
 def set_request_attr(req, name, value, default):
     try:
         getattr(req, name)
@@ -54,6 +127,10 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
         self._any_request = {}
         self._any_response = {}
         self._handler_index_valid = True
+        # compiled dispatch chains (tuples of bound methods), per URL scheme
+        # and per HTTP error kind; rebuilt when the handlers change
+        self._scheme_chains = {}
+        self._error_chains = {}
         self._tempfiles = []
 
     def add_handler(self, handler):
@@ -80,48 +157,24 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
         any_response = set()
         unwanted = []
 
+        lookups = {"open": handle_open,
+                   "request": process_request,
+                   "response": process_response}
         for handler in self.handlers:
             added = False
-            for meth in dir(handler):
-                if meth in ["redirect_request", "do_open", "proxy_open"]:
-                    # oops, coincidental match
-                    continue
-
-                if meth == "any_request":
+            for lookup, scheme, kind, meth in handler_dispatch_methods(handler):
+                added = True
+                if lookup == "any_request":
                     any_request.add(handler)
-                    added = True
                     continue
-                elif meth == "any_response":
+                elif lookup == "any_response":
                     any_response.add(handler)
-                    added = True
                     continue
-
-                ii = meth.find("_")
-                scheme = meth[:ii]
-                condition = meth[ii+1:]
-
-                if condition.startswith("error"):
-                    jj = meth[ii+1:].find("_") + ii + 1
-                    kind = meth[jj+1:]
-                    try:
-                        kind = int(kind)
-                    except ValueError:
-                        pass
-                    lookup = handle_error.setdefault(scheme, {})
-                elif condition == "open":
-                    kind = scheme
-                    lookup = handle_open
-                elif condition == "request":
-                    kind = scheme
-                    lookup = process_request
-                elif condition == "response":
-                    kind = scheme
-                    lookup = process_response
+                elif lookup == "error":
+                    table = handle_error.setdefault(scheme, {})
                 else:
-                    continue
-
-                lookup.setdefault(kind, set()).add(handler)
-                added = True
+                    table = lookups[lookup]
+                table.setdefault(kind, set()).add(handler)
 
             if not added:
                 unwanted.append(handler)
@@ -129,20 +182,17 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
         for handler in unwanted:
             self.handlers.remove(handler)
 
-        # sort indexed methods
-        # XXX could be cleaned up
-        for lookup in [process_request, process_response]:
+        # sort indexed methods, in the (sorted) order of self.handlers
+        order = dict((id(handler), i) for i, handler in
+                     enumerate(self.handlers))
+        def sorted_handlers(handlers):
+            return sorted(handlers, key=lambda h: order[id(h)])
+        for lookup in [handle_open, process_request, process_response]:
             for scheme, handlers in lookup.iteritems():
-                lookup[scheme] = handlers
+                lookup[scheme] = sorted_handlers(handlers)
         for scheme, lookup in handle_error.iteritems():
             for code, handlers in lookup.iteritems():
-                handlers = list(handlers)
-                handlers.sort()
-                lookup[code] = handlers
-        for scheme, handlers in handle_open.iteritems():
-            handlers = list(handlers)
-            handlers.sort()
-            handle_open[scheme] = handlers
+                lookup[code] = sorted_handlers(handlers)
 
         # cache the indexes
         self.handle_error = handle_error
@@ -151,6 +201,48 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
         self.process_response = process_response
         self._any_request = any_request
         self._any_response = any_response
+        self._scheme_chains = {}
+        self._error_chains = {}
+        self._handler_index_valid = True
+
+    def _chains_for_scheme(self, scheme):
+        """Return (request processors, openers, response processors) for URL
+        scheme, as tuples of bound methods in the order they are called.
+
+        The openers are three tuples, tried one after the other: the
+        default_open, <scheme>_open and unknown_open methods.
+        """
+        chains = self._scheme_chains.get(scheme)
+        if chains is not None:
+            return chains
+
+        def processors(by_scheme, any_set, names):
+            handlers = set(by_scheme.get(scheme, []))
+            handlers.update(any_set)
+            chain = []
+            for handler in self.handlers:
+                if handler not in handlers:
+                    continue
+                for meth_name in names:
+                    meth = getattr(handler, meth_name, None)
+                    if meth:
+                        chain.append(meth)
+            return tuple(chain)
+
+        def openers(kind, meth_name):
+            return tuple([getattr(handler, meth_name) for handler in
+                          self.handle_open.get(kind, ())])
+
+        chains = self._scheme_chains[scheme] = (
+            processors(self.process_request, self._any_request,
+                       ["any_request", scheme+"_request"]),
+            (openers("default", "default_open"),
+             openers(scheme, scheme+"_open"),
+             openers("unknown", "unknown_open")),
+            processors(self.process_response, self._any_response,
+                       ["any_response", scheme+"_response"]),
+            )
+        return chains
 
     def _request(self, url_or_req, data, visit,
                  timeout=_sockettimeout._GLOBAL_DEFAULT_TIMEOUT):
@@ -173,59 +265,58 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
         req_scheme = req.get_type()
 
         self._maybe_reindex_handlers()
+        request_chain, open_chains, response_chain = \
+            self._chains_for_scheme(req_scheme)
 
         # pre-process request
         # XXX should we allow a Processor to change the URL scheme
         #   of the request?
-        request_processors = set(self.process_request.get(req_scheme, []))
-        request_processors.update(self._any_request)
-        request_processors = list(request_processors)
-        request_processors.sort()
-        for processor in request_processors:
-            for meth_name in ["any_request", req_scheme+"_request"]:
-                meth = getattr(processor, meth_name, None)
-                if meth:
-                    req = meth(req)
-
-        # In Python >= 2.4, .open() supports processors already, so we must
-        # call ._open() instead.
-        urlopen = _urllib2_fork.OpenerDirector._open
-        response = urlopen(self, req, data)
+        for meth in request_chain:
+            req = meth(req)
+
+        # Like _urllib2_fork.OpenerDirector._open(), with the openers looked
+        # up by the scheme of the request before pre-processing
+        protocol = req.get_type()
+        if protocol != req_scheme:
+            open_chains = self._chains_for_scheme(protocol)[1]
+        for chain in open_chains:
+            response = call_chain(chain, (req,))
+            if response:
+                break
 
         # post-process response
-        response_processors = set(self.process_response.get(req_scheme, []))
-        response_processors.update(self._any_response)
-        response_processors = list(response_processors)
-        response_processors.sort()
-        for processor in response_processors:
-            for meth_name in ["any_response", req_scheme+"_response"]:
-                meth = getattr(processor, meth_name, None)
-                if meth:
-                    response = meth(req, response)
+        for meth in response_chain:
+            response = meth(req, response)
 
         return response
 
+    def _http_error_chain(self, kind, meth_name):
+        chain = self._error_chains.get(kind)
+        if chain is None:
+            # https is not different than http
+            handlers = self.handle_error['http'].get(kind, ())
+            chain = self._error_chains[kind] = tuple(
+                [getattr(handler, meth_name) for handler in handlers])
+        return chain
+
     def error(self, proto, *args):
         if proto in ['http', 'https']:
             # XXX http[s] protocols are special-cased
-            dict = self.handle_error['http'] # https is not different than http
-            proto = args[2]  # YUCK!
-            meth_name = 'http_error_%s' % proto
-            http_err = 1
-            orig_args = args
-        else:
-            dict = self.handle_error
-            meth_name = proto + '_error'
-            http_err = 0
+            code = args[2]  # YUCK!
+            result = call_chain(
+                self._http_error_chain(code, 'http_error_%s' % code), args)
+            if result:
+                return result
+            return call_chain(
+                self._http_error_chain('default', 'http_error_default'), args)
+
+        dict = self.handle_error
+        meth_name = proto + '_error'
         args = (dict, proto, meth_name) + args
         result = apply(self._call_chain, args)
         if result:
             return result
 
-        if http_err:
-            args = (dict, 'default', 'http_error_default') + orig_args
-            return apply(self._call_chain, args)
-
     BLOCK_SIZE = 1024*8
     def retrieve(self, fullurl, filename=None, reporthook=None, data=None,
                  timeout=_sockettimeout._GLOBAL_DEFAULT_TIMEOUT,
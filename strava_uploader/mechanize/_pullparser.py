@@ -36,6 +36,7 @@ under the terms of the BSD or ZPL 2.1 licenses.
 import re, htmlentitydefs
 import _sgmllib_copy as sgmllib
 import HTMLParser
+from cStringIO import StringIO
 from xml.sax import saxutils
 
 from _html import unescape, unescape_charref
@@ -383,6 +384,63 @@ class TolerantPullParser(_AbstractParser, sgmllib.SGMLParser):
         self._tokenstack.append(Token("endtag", tag))
 
 
+class TokenStream:
+    """Tokens of a document, tokenized once and shared by several parsers.
+
+    get_data is a function returning the document, which is called when the
+    first token is needed.  Tokens are only produced as the parsers returned
+    by .parser() ask for them, so a parser that stops early (e.g. after the
+    TITLE) doesn't cause the rest of the document to be tokenized.
+
+    """
+    def __init__(self, get_data, encoding="ascii", entitydefs=None):
+        self._get_data = get_data
+        self._parser = None
+        self._tokens = []
+        self.encoding = encoding
+        self.entitydefs = entitydefs
+
+    def get(self, index):
+        """Return the token at index.
+
+        Raises NoMoreTokensError.
+
+        """
+        tokens = self._tokens
+        if index < len(tokens):
+            return tokens[index]
+        if self._parser is None:
+            self._parser = TolerantPullParser(
+                StringIO(self._get_data()), encoding=self.encoding,
+                entitydefs=self.entitydefs)
+        while index >= len(tokens):
+            tokens.append(self._parser.get_token())
+        return tokens[index]
+
+    def parser(self):
+        """Return a new pull parser reading from the start of the tokens."""
+        return ReplayPullParser(self)
+
+
+class ReplayPullParser(_AbstractParser):
+    """Pull parser that reads tokens from a TokenStream."""
+    def __init__(self, stream, textify={"img": "alt", "applet": "alt"}):
+        _AbstractParser.__init__(self, None, textify, stream.encoding,
+                                 stream.entitydefs)
+        self._stream = stream
+        self._index = 0
+
+    def get_token(self, *tokentypes):
+        while 1:
+            if self._tokenstack:
+                token = self._tokenstack.pop(0)
+            else:
+                token = self._stream.get(self._index)
+                self._index += 1
+            if not tokentypes or token.type in tokentypes:
+                return token
+
+
 def _test():
    import doctest, _pullparser
    return doctest.testmod(_pullparser)
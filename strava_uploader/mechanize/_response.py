@@ -31,6 +31,60 @@ def len_of_seekable(file_):
         file_.seek(pos)
 
 
+class _Cache:
+    """Data read from a wrapped file, shared by copies of a seek_wrapper.
+
+    The length is always known.  Data that was read in one go (e.g. a whole
+    response body) is kept as the string that was read, so it's handed back
+    without copying.  Data read in pieces is appended to a bytearray, and a
+    string of all of it is only made (once) when it's asked for.
+    """
+
+    def __init__(self):
+        self.length = 0
+        self._value = ""  # all the data, or None if not made yet
+        self._buf = None
+
+    def append(self, data):
+        if not data:
+            return
+        if self.length == 0:
+            self._value = data
+        else:
+            if self._buf is None:
+                self._buf = bytearray(self._value)
+            self._buf.extend(data)
+            self._value = None
+        self.length += len(data)
+
+    def getvalue(self):
+        if self._value is None:
+            self._value = str(self._buf)
+        return self._value
+
+    def read(self, pos, size):
+        if size <= 0 or pos >= self.length:
+            return ""
+        if self._value is not None:
+            if pos == 0 and size >= self.length:
+                return self._value
+            return self._value[pos:pos+size]
+        return str(buffer(self._buf, pos, size))
+
+    def readline(self, pos, size=-1):
+        if self._value is not None:
+            end = self._value.find("\n", pos)
+        else:
+            end = self._buf.find("\n", pos)
+        if end == -1:
+            end = self.length
+        else:
+            end += 1
+        if size != -1 and pos + size < end:
+            end = pos + size
+        return self.read(pos, end - pos)
+
+
 # XXX Andrew Dalke kindly sent me a similar class in response to my request on
 # comp.lang.python, which I then proceeded to lose.  I wrote this class
 # instead, but I think he's released his code publicly since, could pinch the
@@ -65,7 +119,7 @@ class seek_wrapper:
 
     """
     # General strategy is to check that cache is full enough, then delegate to
-    # the cache (self.__cache, which is a cStringIO.StringIO instance).  A seek
+    # the cache (self.__cache, which is a _Cache instance).  A seek
     # position (self.__pos) is maintained independently of the cache, in order
     # that a single cache may be shared between multiple seek_wrapper objects.
     # Copying using module copy shares the cache in this way.
@@ -75,14 +129,14 @@ class seek_wrapper:
         self.__read_complete_state = [False]
         self.__is_closed_state = [False]
         self.__have_readline = hasattr(self.wrapped, "readline")
-        self.__cache = StringIO()
+        self.__cache = _Cache()
         self.__pos = 0  # seek position
 
     def invariant(self):
         # The end of the cache is always at the same place as the end of the
         # wrapped file (though the .tell() method is not required to be present
         # on wrapped file).
-        return self.wrapped.tell() == len(self.__cache.getvalue())
+        return self.wrapped.tell() == self.__cache.length
 
     def close(self):
         self.wrapped.close()
@@ -127,24 +181,23 @@ class seek_wrapper:
                 if pos < offset:
                     raise ValueError("seek to before start of file")
                 dest = pos + offset
-            end = len_of_seekable(self.__cache)
+            end = self.__cache.length
             to_read = dest - end
             if to_read < 0:
                 to_read = 0
 
         if to_read != 0:
-            self.__cache.seek(0, 2)
             if to_read is None:
                 assert whence == 2
-                self.__cache.write(self.wrapped.read())
+                self.__cache.append(self.wrapped.read())
                 self.read_complete = True
-                self.__pos = self.__cache.tell() - offset
+                self.__pos = self.__cache.length - offset
             else:
                 data = self.wrapped.read(to_read)
                 if not data:
                     self.read_complete = True
                 else:
-                    self.__cache.write(data)
+                    self.__cache.append(data)
                 # Don't raise an exception even if we've seek()ed past the end
                 # of .wrapped, since fseek() doesn't complain in that case.
                 # Also like fseek(), pretend we have seek()ed past the end,
@@ -175,20 +228,19 @@ class seek_wrapper:
 
     def read(self, size=-1):
         pos = self.__pos
-        end = len_of_seekable(self.__cache)
-        available = end - pos
+        cache = self.__cache
+        available = cache.length - pos
 
         # enough data already cached?
         if size <= available and size != -1:
-            self.__cache.seek(pos)
             self.__pos = pos+size
-            return self.__cache.read(size)
+            return cache.read(pos, size)
 
         # no, so read sufficient data from wrapped file and cache it
-        self.__cache.seek(0, 2)
         if size == -1:
-            self.__cache.write(self.wrapped.read())
+            cache.append(self.wrapped.read())
             self.read_complete = True
+            size = cache.length - pos
         else:
             to_read = size - available
             assert to_read > 0
@@ -196,12 +248,10 @@ class seek_wrapper:
             if not data:
                 self.read_complete = True
             else:
-                self.__cache.write(data)
-        self.__cache.seek(pos)
+                cache.append(data)
 
-        data = self.__cache.read(size)
-        self.__pos = self.__cache.tell()
-        assert self.__pos == pos + len(data)
+        data = cache.read(pos, size)
+        self.__pos = pos + len(data)
         return data
 
     def readline(self, size=-1):
@@ -211,32 +261,32 @@ class seek_wrapper:
         # line we're about to read might not be complete in the cache, so
         # read another line first
         pos = self.__pos
-        self.__cache.seek(0, 2)
         data = self.wrapped.readline()
         if not data:
             self.read_complete = True
         else:
-            self.__cache.write(data)
-        self.__cache.seek(pos)
+            self.__cache.append(data)
 
-        data = self.__cache.readline()
-        if size != -1:
-            r = data[:size]
-            self.__pos = pos+size
-        else:
-            r = data
-            self.__pos = pos+len(data)
+        r = self.__cache.readline(pos, size)
+        self.__pos = pos+len(r)
         return r
 
     def readlines(self, sizehint=-1):
         pos = self.__pos
-        self.__cache.seek(0, 2)
-        self.__cache.write(self.wrapped.read())
+        cache = self.__cache
+        cache.append(self.wrapped.read())
         self.read_complete = True
-        self.__cache.seek(pos)
-        data = self.__cache.readlines(sizehint)
-        self.__pos = self.__cache.tell()
-        return data
+        lines = []
+        total = 0
+        while pos < cache.length:
+            line = cache.readline(pos)
+            lines.append(line)
+            pos += len(line)
+            total += len(line)
+            if 0 < sizehint <= total:
+                break
+        self.__pos = pos
+        return lines
 
     def __iter__(self): return self
     def next(self):
@@ -284,8 +334,8 @@ class response_seek_wrapper(seek_wrapper):
         self.seek(0)
         self.read()
         self.close()
-        cache = self._seek_wrapper__cache = StringIO()
-        cache.write(data)
+        cache = self._seek_wrapper__cache = _Cache()
+        cache.append(data)
         self.seek(0)
 
 
@@ -18,6 +18,7 @@ from _urllib2_fork import \
      AbstractDigestAuthHandler, \
      BaseHandler, \
      CacheFTPHandler, \
+     ConnectionPool, \
      FileHandler, \
      FTPHandler, \
      HTTPBasicAuthHandler, \
@@ -38,7 +39,8 @@ from _http import \
      HTTPRefererProcessor, \
      HTTPRefreshProcessor, \
      HTTPRobotRulesProcessor, \
-     RobotExclusionError
+     RobotExclusionError, \
+     RobotRulesCache
 import httplib
 if hasattr(httplib, 'HTTPS'):
     from _urllib2_fork import HTTPSHandler
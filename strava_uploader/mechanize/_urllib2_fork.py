@@ -37,8 +37,10 @@ import os
 import posixpath
 import random
 import re
+import select
 import socket
 import sys
+import threading
 import time
 import urllib
 import urlparse
@@ -1029,6 +1031,121 @@ class ProxyDigestAuthHandler(BaseHandler, AbstractDigestAuthHandler):
         self.reset_retry_count()
         return retry
 
+# size of the chunks a file-like request body is sent in, in bytes
+SEND_CHUNK_SIZE = 64 * 1024
+
+# requests that may be sent again on a new connection if the server closed
+# a pooled one after receiving them, without answering
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+def _connection_is_stale(conn):
+    sock = conn.sock
+    if sock is None:
+        return True
+    try:
+        readable = select.select([sock], [], [], 0)[0]
+    except (select.error, socket.error, ValueError):
+        return True
+    # nothing should arrive on an idle connection, unless the server has
+    # closed it
+    return bool(readable)
+
+class ConnectionPool:
+    """Idle persistent HTTP connections, for reuse by AbstractHTTPHandler.
+
+    Connections are keyed by (scheme, host:port, proxy tunnel host).  At most
+    max_idle idle connections are kept per key.  Connections that have been
+    idle for more than idle_timeout seconds, or that the server has closed,
+    are discarded instead of being reused.
+
+    """
+
+    def __init__(self, max_idle=4, idle_timeout=60):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return an idle connection for key, or None."""
+        now = time.time()
+        while True:
+            self._lock.acquire()
+            try:
+                conns = self._idle.get(key)
+                if not conns:
+                    return None
+                conn, released = conns.pop()
+            finally:
+                self._lock.release()
+            if (now - released < self.idle_timeout and
+                not _connection_is_stale(conn)):
+                return conn
+            conn.close()
+
+    def put(self, key, conn):
+        """Return a connection to the pool once its response has been read."""
+        self._lock.acquire()
+        try:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append((conn, time.time()))
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = {}
+        finally:
+            self._lock.release()
+        for conns in idle.itervalues():
+            for conn, released in conns:
+                conn.close()
+
+class PooledHTTPResponse(httplib.HTTPResponse):
+    """HTTPResponse that hands its connection back when it has been read.
+
+    The connection is released to its ConnectionPool when the body has been
+    read to the end.  If the response is closed before that, the connection
+    still has unread data on it, so it is closed instead.
+
+    """
+
+    def __init__(self, *args, **kwds):
+        httplib.HTTPResponse.__init__(self, *args, **kwds)
+        self._release = None
+        self._reading = False
+
+    def read(self, amt=None):
+        # httplib closes the response itself when the end of the body is
+        # read, so defer releasing the connection until read returns
+        self._reading = True
+        try:
+            data = httplib.HTTPResponse.read(self, amt)
+        except:
+            self._reading = False
+            self._release_connection(False)
+            raise
+        self._reading = False
+        if self.isclosed():
+            self._release_connection(True)
+        return data
+
+    def close(self):
+        httplib.HTTPResponse.close(self)
+        if not self._reading:
+            self._release_connection(self.length == 0)
+
+    def _release_connection(self, reusable):
+        release, self._release = self._release, None
+        if release is not None:
+            release(reusable and not self.will_close)
+
 class AbstractHTTPHandler(BaseHandler):
 
     def __init__(self, debuglevel=0):
@@ -1080,42 +1197,74 @@ class AbstractHTTPHandler(BaseHandler):
         if not host_port:
             raise URLError('no host given')
 
-        try:
-            h = http_class(host_port, timeout=req.timeout)
-        except TypeError:
-            # Python < 2.6, no per-connection timeout support
-            h = http_class(host_port)
-        h.set_debuglevel(self._debuglevel)
+        pool = getattr(self.parent, "_http_conn_cache", None)
 
         headers = dict(req.headers)
         headers.update(req.unredirected_hdrs)
-        # We want to make an HTTP/1.1 request, but the addinfourl
-        # class isn't prepared to deal with a persistent connection.
-        # It will try to read all remaining data from the socket,
-        # which will block while the server waits for the next request.
-        # So make sure the connection gets closed after the (only)
-        # request.
-        headers["Connection"] = "close"
+        if pool is None:
+            # We want to make an HTTP/1.1 request, but without a connection
+            # pool to hand the connection back to, nothing would close it.
+            # So make sure the connection gets closed after the (only)
+            # request.
+            headers["Connection"] = "close"
         headers = dict(
             (name.title(), val) for name, val in headers.items())
 
-        if req._tunnel_host:
-            if not hasattr(h, "set_tunnel"):
-                if not hasattr(h, "_set_tunnel"):
-                    raise URLError("HTTPS through proxy not supported "
-                                   "(Python >= 2.6.4 required)")
+        h = r = None
+        if pool is not None:
+            # a tunnel through a proxy is set up per connection, so
+            # connections can only be shared by requests for the same tunnel
+            pool_key = (req.get_type(), host_port, req._tunnel_host)
+            h = pool.get(pool_key)
+        if h is not None:
+            h.set_debuglevel(self._debuglevel)
+            # the connection was opened with an earlier request's timeout
+            if h.sock is not None:
+                timeout = req.timeout
+                if timeout is _sockettimeout._GLOBAL_DEFAULT_TIMEOUT:
+                    timeout = socket.getdefaulttimeout()
+                h.sock.settimeout(timeout)
+            body_pos = None
+            if hasattr(req.data, "tell"):
+                body_pos = req.data.tell()
+            sent = False
+            try:
+                self._send_request(h, req, headers)
+                sent = True
+                r = h.getresponse()
+            except socket.timeout, err:
+                # The server is slow rather than gone, so a new connection
+                # wouldn't help
+                h.close()
+                raise URLError(err)
+            except (socket.error, httplib.HTTPException), err:
+                # The server closed the connection while it was idle, and we
+                # couldn't tell until we used it.  Retry once on a new one.
+                # A complete request may have been acted on, though (the
+                # response may be what got lost), so only one that is safe
+                # to repeat is sent again.
+                h.close()
+                if sent and req.get_method() not in IDEMPOTENT_METHODS:
+                    raise URLError(err)
+                if hasattr(req.data, "read"):
+                    if body_pos is None:
+                        raise URLError(err)
+                    req.data.seek(body_pos)
+        if r is None:
+            h = self._new_connection(http_class, req, pool is not None)
+            try:
+                self._send_request(h, req, headers)
+                r = h.getresponse()
+            except socket.error, err: # XXX what error?
+                raise URLError(err)
+
+        if pool is not None:
+            def release(reusable, pool=pool, key=pool_key, conn=h):
+                if reusable:
+                    pool.put(key, conn)
                 else:
-                    # python 2.6
-                    set_tunnel = h._set_tunnel
-            else:
-                set_tunnel = h.set_tunnel
-            set_tunnel(req._tunnel_host)
-
-        try:
-            h.request(req.get_method(), req.get_selector(), req.data, headers)
-            r = h.getresponse()
-        except socket.error, err: # XXX what error?
-            raise URLError(err)
+                    conn.close()
+            r._release = release
 
         # Pick apart the HTTPResponse object to get the addinfourl
         # object initialized properly.
@@ -1135,6 +1284,44 @@ class AbstractHTTPHandler(BaseHandler):
                                   r.status, r.reason)
         return resp
 
+    def _new_connection(self, http_class, req, pooled):
+        try:
+            h = http_class(req.get_host(), timeout=req.timeout)
+        except TypeError:
+            # Python < 2.6, no per-connection timeout support
+            h = http_class(req.get_host())
+        h.set_debuglevel(self._debuglevel)
+        if pooled:
+            h.response_class = PooledHTTPResponse
+
+        if req._tunnel_host:
+            if not hasattr(h, "set_tunnel"):
+                if not hasattr(h, "_set_tunnel"):
+                    raise URLError("HTTPS through proxy not supported "
+                                   "(Python >= 2.6.4 required)")
+                else:
+                    # python 2.6
+                    set_tunnel = h._set_tunnel
+            else:
+                set_tunnel = h.set_tunnel
+            set_tunnel(req._tunnel_host)
+        return h
+
+    def _send_request(self, h, req, headers):
+        if hasattr(req.data, "read"):
+            # File-like body (eg. a multipart upload): send the headers
+            # (Content-Length is already set by do_request_), then the
+            # body a chunk at a time, so it's never all in memory at once.
+            h.request(req.get_method(), req.get_selector(), None, headers)
+            while True:
+                chunk = req.data.read(SEND_CHUNK_SIZE)
+                if not chunk:
+                    break
+                h.send(chunk)
+        else:
+            h.request(req.get_method(), req.get_selector(), req.data,
+                      headers)
+
 
 class HTTPHandler(AbstractHTTPHandler):
 
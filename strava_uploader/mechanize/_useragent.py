@@ -11,7 +11,6 @@ included with the distribution).
 
 """
 
-import warnings
 
 import _auth
 import _gzip
@@ -69,7 +68,7 @@ class UserAgentBase(_opener.OpenerDirector):
         "_proxy_basicauth": _urllib2.ProxyBasicAuthHandler,
         "_proxy_digestauth": _urllib2.ProxyDigestAuthHandler,
         "_robots": _urllib2.HTTPRobotRulesProcessor,
-        "_gzip": _gzip.HTTPGzipProcessor,  # experimental!
+        "_gzip": _gzip.HTTPGzipProcessor,
 
         # debug handlers
         "_debug_redirect": _urllib2.HTTPRedirectDebugProcessor,
@@ -82,54 +81,117 @@ class UserAgentBase(_opener.OpenerDirector):
                         "_refresh", "_equiv",
                         "_basicauth", "_digestauth",
                         "_proxy", "_proxy_basicauth", "_proxy_digestauth",
-                        "_robots",
+                        "_robots", "_gzip",
                         ]
+
+    # handlers of the "minimal" profile, for API-style use: HTTP(S) with
+    # cookies, redirects, content decoding, proxies and error handling
+    minimal_schemes = ["http"]
+    minimal_others = ["_unknown", "_http_error", "_http_default_error"]
+    minimal_features = ["_redirect", "_cookies", "_proxy", "_gzip"]
+
     if hasattr(_urllib2, 'HTTPSHandler'):
         handler_classes["https"] = _urllib2.HTTPSHandler
         default_schemes.append("https")
+        minimal_schemes.append("https")
+
+    # handlers that aren't created until they are needed: scheme handlers
+    # when a URL with that scheme is first opened, and the auth handlers
+    # (with their password managers) when a password is first added
+    lazy_handlers = ["ftp", "file",
+                     "_basicauth", "_digestauth",
+                     "_proxy_basicauth", "_proxy_digestauth"]
 
-    def __init__(self):
+    def __init__(self, profile="default"):
+        """
+        profile: "default" for all the handlers in .default_schemes,
+         .default_others and .default_features, or "minimal" for just
+         those in .minimal_schemes, .minimal_others and .minimal_features.
+
+        """
         _opener.OpenerDirector.__init__(self)
 
-        ua_handlers = self._ua_handlers = {}
-        for scheme in (self.default_schemes+
-                       self.default_others+
-                       self.default_features):
-            klass = self.handler_classes[scheme]
-            ua_handlers[scheme] = klass()
-        for handler in ua_handlers.itervalues():
-            self.add_handler(handler)
-
-        # Yuck.
-        # Ensure correct default constructor args were passed to
-        # HTTPRefreshProcessor and HTTPEquivProcessor.
-        if "_refresh" in ua_handlers:
-            self.set_handle_refresh(True)
-        if "_equiv" in ua_handlers:
-            self.set_handle_equiv(True)
-        # Ensure default password managers are installed.
-        pm = ppm = None
-        if "_basicauth" in ua_handlers or "_digestauth" in ua_handlers:
-            pm = _urllib2.HTTPPasswordMgrWithDefaultRealm()
-        if ("_proxy_basicauth" in ua_handlers or
-            "_proxy_digestauth" in ua_handlers):
-            ppm = _auth.HTTPProxyPasswordMgr()
-        self.set_password_manager(pm)
-        self.set_proxy_password_manager(ppm)
-        # set default certificate manager
-        if "https" in ua_handlers:
-            cm = _urllib2.HTTPSClientCertMgr()
-            self.set_client_cert_manager(cm)
+        self._ua_handlers = {}
+        self._lazy_handlers = set()
+        self._password_manager = None
+        self._proxy_password_manager = None
+        self._client_cert_manager = None
+        self._robot_rules_cache = None
+        for name in self._profile_handlers(profile):
+            if name in self.lazy_handlers:
+                self._lazy_handlers.add(name)
+            # Yuck.
+            # Ensure correct default constructor args are passed to
+            # HTTPRefreshProcessor and HTTPEquivProcessor.
+            elif name == "_refresh":
+                self.set_handle_refresh(True)
+            elif name == "_equiv":
+                self.set_handle_equiv(True)
+            else:
+                self._set_handler(name, True)
+        # keep HTTP(S) connections alive between requests
+        self._http_conn_cache = None
+        self._own_http_conn_cache = False
+        self.set_http_connection_cache(_urllib2.ConnectionPool())
+        self._own_http_conn_cache = True
+
+    def _profile_handlers(self, profile):
+        if profile == "default":
+            return (self.default_schemes+
+                    self.default_others+
+                    self.default_features)
+        elif profile == "minimal":
+            return (self.minimal_schemes+
+                    self.minimal_others+
+                    self.minimal_features)
+        raise ValueError("unknown profile '%s'" % profile)
+
+    def _chains_for_scheme(self, scheme):
+        if scheme in self._lazy_handlers:
+            self._set_handler(scheme, True)
+            self._maybe_reindex_handlers()
+        return _opener.OpenerDirector._chains_for_scheme(self, scheme)
+
+    def _create_lazy_handlers(self, names):
+        # true if any of the handlers in names are wanted but haven't been
+        # created yet; the caller creates them
+        if not self._lazy_handlers.intersection(names):
+            return False
+        self._lazy_handlers.difference_update(names)
+        return True
 
     def close(self):
         _opener.OpenerDirector.close(self)
         self._ua_handlers = None
+        self.set_http_connection_cache(None)
+
+    def set_http_connection_cache(self, conn_cache):
+        """Set a mechanize.ConnectionPool, or None.
+
+        HTTP and HTTPS connections are kept open in the pool after their
+        response has been read, and reused by later requests to the same host.
+        With None, every request uses a new connection, closed after the
+        response.  To change how many idle connections are kept and for how
+        long, eg:
+
+        ua.set_http_connection_cache(
+            mechanize.ConnectionPool(max_idle=2, idle_timeout=30))
+
+        A pool that is set here may be shared by several user agents, so it
+        is left open by .close() and when it is replaced; closing it is up
+        to the caller.  Only the pool the user agent created is closed.
+
+        """
+        if (self._http_conn_cache is not None and
+            self._own_http_conn_cache and
+            self._http_conn_cache is not conn_cache):
+            self._http_conn_cache.close()
+        self._http_conn_cache = conn_cache
+        self._own_http_conn_cache = False
 
     # XXX
 ##     def set_timeout(self, timeout):
 ##         self._timeout = timeout
-##     def set_http_connection_cache(self, conn_cache):
-##         self._http_conn_cache = conn_cache
 ##     def set_ftp_connection_cache(self, conn_cache):
 ##         # XXX ATM, FTP has cache as part of handler; should it be separate?
 ##         self._ftp_conn_cache = conn_cache
@@ -152,6 +214,12 @@ class UserAgentBase(_opener.OpenerDirector):
             want[scheme] = None
 
         # get rid of scheme handlers we don't want
+        for scheme in list(self._lazy_handlers):
+            if scheme.startswith("_"): continue  # not a scheme handler
+            if scheme not in want:
+                self._lazy_handlers.discard(scheme)
+            else:
+                del want[scheme]  # will be created when needed
         for scheme, oldhandler in self._ua_handlers.items():
             if scheme.startswith("_"): continue  # not a scheme handler
             if scheme not in want:
@@ -196,8 +264,14 @@ class UserAgentBase(_opener.OpenerDirector):
                                                 proxy_bypass=proxy_bypass))
 
     def add_password(self, url, user, password, realm=None):
+        if self._create_lazy_handlers(["_basicauth", "_digestauth"]):
+            self.set_password_manager(
+                _urllib2.HTTPPasswordMgrWithDefaultRealm())
         self._password_manager.add_password(realm, url, user, password)
     def add_proxy_password(self, user, password, hostport=None, realm=None):
+        if self._create_lazy_handlers(["_proxy_basicauth",
+                                       "_proxy_digestauth"]):
+            self.set_proxy_password_manager(_auth.HTTPProxyPasswordMgr())
         self._proxy_password_manager.add_password(
             realm, hostport, user, password)
 
@@ -218,17 +292,23 @@ class UserAgentBase(_opener.OpenerDirector):
         third-party libraries that (I assume) allow more options here.
 
         """
+        if (self._client_cert_manager is None and
+            "https" in self._ua_handlers):
+            self.set_client_cert_manager(_urllib2.HTTPSClientCertMgr())
         self._client_cert_manager.add_key_cert(url, key_file, cert_file)
 
     # the following are rarely useful -- use add_password / add_proxy_password
     # instead
     def set_password_manager(self, password_manager):
         """Set a mechanize.HTTPPasswordMgrWithDefaultRealm, or None."""
+        self._lazy_handlers.difference_update(["_basicauth", "_digestauth"])
         self._password_manager = password_manager
         self._set_handler("_basicauth", obj=password_manager)
         self._set_handler("_digestauth", obj=password_manager)
     def set_proxy_password_manager(self, password_manager):
         """Set a mechanize.HTTPProxyPasswordMgr, or None."""
+        self._lazy_handlers.difference_update(["_proxy_basicauth",
+                                               "_proxy_digestauth"])
         self._proxy_password_manager = password_manager
         self._set_handler("_proxy_basicauth", obj=password_manager)
         self._set_handler("_proxy_digestauth", obj=password_manager)
@@ -241,7 +321,19 @@ class UserAgentBase(_opener.OpenerDirector):
     # these methods all take a boolean parameter
     def set_handle_robots(self, handle):
         """Set whether to observe rules from robots.txt."""
-        self._set_handler("_robots", handle)
+        self._set_handler("_robots", handle, constructor_kwds=
+                          {"cache": self._robot_rules_cache})
+    def set_robot_rules_cache(self, cache):
+        """Set a mechanize.RobotRulesCache to keep robots.txt rules in.
+
+        None means the cache shared by all user agents that weren't given
+        one.
+        """
+        self._robot_rules_cache = cache
+        handler = self._ua_handlers.get("_robots")
+        if handler is not None:
+            self._set_handler("_robots", handler in self.handlers,
+                              constructor_kwds={"cache": cache})
     def set_handle_redirect(self, handle):
         """Set whether to handle HTTP 30x redirections."""
         self._set_handler("_redirect", handle)
@@ -262,12 +354,11 @@ class UserAgentBase(_opener.OpenerDirector):
             constructor_kwds={}
         self._set_handler("_equiv", handle, constructor_kwds=constructor_kwds)
     def set_handle_gzip(self, handle):
-        """Handle gzip transfer encoding.
+        """Ask for gzip or deflate content encoding, and decode it (default).
+
+        Responses are decompressed as they are read.
 
         """
-        if handle:
-            warnings.warn(
-                "gzip transfer encoding is experimental!", stacklevel=2)
         self._set_handler("_gzip", handle)
     def set_debug_redirects(self, handle):
         """Log information about HTTP redirects (including refreshes).
@@ -329,6 +420,7 @@ class UserAgentBase(_opener.OpenerDirector):
         self._replace_handler(name, newhandler)
 
     def _replace_handler(self, name, newhandler=None):
+        self._lazy_handlers.discard(name)
         # first, if handler was previously added, remove it
         if name is not None:
             handler = self._ua_handlers.get(name)
@@ -337,6 +429,8 @@ class UserAgentBase(_opener.OpenerDirector):
                     self.handlers.remove(handler)
                 except ValueError:
                     pass
+                else:
+                    self._handler_index_valid = False
         # then add the replacement, if any
         if newhandler is not None:
             self.add_handler(newhandler)
@@ -345,8 +439,8 @@ class UserAgentBase(_opener.OpenerDirector):
 
 class UserAgent(UserAgentBase):
 
-    def __init__(self):
-        UserAgentBase.__init__(self)
+    def __init__(self, profile="default"):
+        UserAgentBase.__init__(self, profile)
         self._seekable = False
 
     def set_seekable_responses(self, handle):
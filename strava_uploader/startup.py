@@ -0,0 +1,75 @@
+#
+# Copyright (C) 2013  Per Myren
+#
+# This file is part of Bryton-Strava-Uploader
+#
+# Bryton-Strava-Uploader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bryton-Strava-Uploader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bryton-Strava-Uploader.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Times how long the uploader takes to reach each stage of starting up,
+like the first paint of the window and finding the device.  The times are
+logged to the file named by BSU_STARTUP_LOG (see README.rst)."""
+
+import os
+import sys
+import time
+import logging
+
+
+
+ENV_VAR = 'BSU_STARTUP_LOG'
+
+
+_logger = logging.getLogger(__name__)
+
+_started = time.time()
+_times = {}
+
+
+
+def start():
+    """Measure from now on, and log the times if BSU_STARTUP_LOG is set."""
+
+    global _started
+    _started = time.time()
+
+    path = os.environ.get(ENV_VAR)
+    if not path or _logger.handlers:
+        return
+
+    if path == '-':
+        handler = logging.StreamHandler(sys.stderr)
+    else:
+        handler = logging.FileHandler(path, 'w')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+
+    _logger.addHandler(handler)
+    _logger.setLevel(logging.INFO)
+
+
+def mark(stage):
+    """Record the time taken to reach stage, the first time it's reached."""
+
+    if stage in _times:
+        return
+
+    _times[stage] = time.time() - _started
+    _logger.info('%s after %.0f ms', stage, _times[stage] * 1000)
+
+
+def elapsed(stage):
+    """Return the seconds taken to reach stage, or None if it hasn't been."""
+
+    return _times.get(stage)
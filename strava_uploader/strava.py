@@ -20,19 +20,69 @@
 
 from __future__ import absolute_import
 
+import httplib
 import json
+import socket
+import threading
+import time
 import urllib2
-
-import cStringIO as StringIO
+import urlparse
+import weakref
 
 from . import mechanize
 
 
 
-_URL_LOGIN = 'https://www.strava.com/login'
-_URL_UPLOAD = 'http://app.strava.com/upload/select'
-_URL_UPLOAD_STATUS = 'http://app.strava.com/upload/progress.json?' \
-        'new_uploader=true'
+_BASE_URL = 'https://www.strava.com'
+_PATH_LOGIN = '/login'
+_PATH_UPLOAD = '/upload/select'
+_PATH_UPLOAD_STATUS = '/upload/progress.json?new_uploader=true'
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Seconds to wait for Strava when checking a saved session, which is done
+# at startup and shouldn't hold up uploading for long when Strava is slow
+_CHECK_TIMEOUT = 10
+
+# Cookie attributes saved with the login session, in the order of the
+# mechanize.Cookie constructor's arguments
+_COOKIE_ATTRS = ('version', 'name', 'value', 'port', 'port_specified',
+                 'domain', 'domain_specified', 'domain_initial_dot',
+                 'path', 'path_specified', 'secure', 'expires', 'discard',
+                 'comment', 'comment_url', '_rest', 'rfc2109')
+
+
+class StravaEndpoints(object):
+    """The URLs StravaUploader talks to.
+
+    Every path is put on the scheme and host of base_url, so that login,
+    uploads and progress polling can all share one kept-alive connection.
+    A path may also be given as a full URL, in which case only its path and
+    query are used.
+    """
+
+    def __init__(self, base_url=_BASE_URL, login=_PATH_LOGIN,
+                 upload=_PATH_UPLOAD, upload_status=_PATH_UPLOAD_STATUS):
+
+        base = urlparse.urlsplit(base_url)
+        scheme = base.scheme.lower()
+        netloc = base.hostname
+        if base.port is not None and base.port != _DEFAULT_PORTS.get(scheme):
+            netloc += ':%d' % base.port
+        self.base_url = '%s://%s' % (scheme, netloc)
+
+        self.login = self._url(login)
+        self.upload = self._url(upload)
+        self.upload_status = self._url(upload_status)
+
+
+    def _url(self, path):
+
+        url = urlparse.urlsplit(path)
+        return urlparse.urljoin(self.base_url, urlparse.urlunsplit(
+            ('', '', url.path or '/', url.query, '')))
+
+
 
 class StravaError(urllib2.URLError):
     pass
@@ -47,29 +97,89 @@ def _open_url(browser, url):
     except mechanize.HTTPError as e:
         raise StravaError(str(e))
 
-def _get_response(browser):
+def _open_json(browser, url):
+
+    # JSON responses aren't visited, so they aren't parsed as HTML or kept
+    # in the browser history
+    try:
+        response = browser.open_novisit(url)
+    except mechanize.HTTPError as e:
+        raise StravaError(str(e))
+
     try:
-        return json.loads(browser.response().get_data())
+        return json.load(response)
     except ValueError, e:
         raise StravaError('Failed to parse JSON response')
+    finally:
+        response.close()
 
 
 class StravaUploader(object):
 
-    def __init__(self):
+    def __init__(self, endpoints=None, robots_path=None):
+
+        if endpoints is None:
+            endpoints = StravaEndpoints()
+        self.endpoints = endpoints
 
-        self.browser = mechanize.Browser()
+        self._cookiejar = mechanize.CookieJar()
+        self._conn_cache = mechanize.ConnectionPool()
+        # robots.txt is only checked for the pages that are browsed, and
+        # its rules are kept in robots_path between runs
+        self._robot_rules = mechanize.RobotRulesCache(robots_path)
+
+        self.browser = self._newBrowser()
+        # For the JSON endpoints and session checks, which aren't browsed
+        self._api_browser = self._newBrowser('minimal')
+        # For upload(), one per thread that uploads
+        self._local = threading.local()
+        self._upload_browsers = weakref.WeakSet()
         self.authenticated = False
 
 
+    def _newBrowser(self, profile='default'):
+
+        # A Browser can only be used by one thread at a time, but browsers
+        # can share the login session and the open connections
+        browser = mechanize.Browser(profile=profile)
+        browser.set_cookiejar(self._cookiejar)
+        browser.set_http_connection_cache(self._conn_cache)
+        browser.set_robot_rules_cache(self._robot_rules)
+        return browser
+
+
+    def _uploadBrowser(self):
+
+        # Each thread reuses its own browser, so that several uploads can run
+        # at once.  It only needs HTTP(S), cookies and redirects.
+        browser = getattr(self._local, 'browser', None)
+        if browser is None:
+            browser = self._newBrowser('minimal')
+            self._local.browser = browser
+            self._upload_browsers.add(browser)
+        else:
+            # Only the upload page is needed, not the ones of earlier uploads
+            browser.clear_history()
+        return browser
+
+
+    def close(self):
+
+        # The browsers leave the shared connections open, so they're closed
+        # here
+        for browser in list(self._upload_browsers):
+            browser.close()
+        self.browser.close()
+        self._api_browser.close()
+        self._conn_cache.close()
+
+
     def authenticate(self, email, password):
 
-        _open_url(self.browser, _URL_LOGIN)
+        _open_url(self.browser, self.endpoints.login)
 
         try:
-            self.browser.select_form(
-                predicate=lambda f: 'id' in f.attrs and \
-                f.attrs['id'] == 'login_form')
+            self.browser.select_form(id='login_form')
         except mechanize.FormNotFoundError as e:
             raise StravaError('Login form not found')
 
@@ -81,83 +191,168 @@ class StravaUploader(object):
         except mechanize.HTTPError as e:
             raise StravaError(str(e))
 
-        if self.browser.geturl() == _URL_LOGIN:
+        if self.browser.geturl() == self.endpoints.login:
             raise StravaError('Failed to authenticate')
 
         self.authenticated = True
 
 
+    def saveSession(self):
+        """Return the cookies of the login session, as a string that can be
+        passed to restoreSession()."""
+
+        cookies = []
+        for cookie in self._cookiejar:
+            cookies.append([getattr(cookie, a) for a in _COOKIE_ATTRS])
+        return json.dumps(cookies)
+
+
+    def restoreSession(self, data):
+        """Restore the cookies saved by saveSession().  The session may have
+        expired, so check it with checkSession() before relying on it."""
+
+        try:
+            cookies = json.loads(data)
+        except ValueError:
+            return
+
+        now = time.time()
+        for attrs in cookies:
+            try:
+                cookie = mechanize.Cookie(*attrs)
+            except (TypeError, ValueError, AttributeError):
+                continue
+            if not cookie.is_expired(now):
+                self._cookiejar.set_cookie(cookie)
+
+
+    def checkSession(self):
+        """Check with a single request whether the login session is valid,
+        and return the new value of self.authenticated."""
+
+        if not len(self._cookiejar):
+            self.authenticated = False
+            return False
+
+        try:
+            response = self._api_browser.open_novisit(
+                self.endpoints.upload, timeout=_CHECK_TIMEOUT)
+            try:
+                response.read()
+            finally:
+                response.close()
+        except (mechanize.URLError, socket.error,
+                httplib.HTTPException) as e:
+            raise StravaError(str(getattr(e, 'reason', e)))
+
+        # Without a valid session Strava redirects to the login page
+        login = urlparse.urlsplit(self.endpoints.login).path
+        self.authenticated = (
+            urlparse.urlsplit(response.geturl()).path != login)
+        return self.authenticated
+
+
     def upload(self, tracks):
+        """Upload the (filename, path) tracks.  May be called from several
+        threads at once; the UploadStatus returned uses the calling thread's
+        browser, so it must be polled from that thread, or use status()."""
+
+        browser = self._uploadBrowser()
 
-        _open_url(self.browser, _URL_UPLOAD)
+        _open_url(browser, self.endpoints.upload)
 
         try:
-            self.browser.select_form(
-                predicate=lambda f: 'action' in f.attrs and \
-                f.attrs['action'] == '/upload/files')
+            browser.select_form(action='/upload/files')
         except mechanize.FormNotFoundError as e:
             raise StravaError('Upload form not found')
 
 
-        for filename, data in tracks:
-            self.browser.form.add_file(StringIO.StringIO(data),
-                                       'application/octet-stream',
-                                       filename, name='files[]')
-
-
+        # The files are streamed from disk as the request body is sent, so
+        # they must stay open until the submit has completed
+        files = []
         try:
-            self.browser.submit()
-        except mechanize.HTTPError as e:
-            raise StravaError(str(e))
+            for filename, path in tracks:
+                f = open(path, 'rb')
+                files.append(f)
+                browser.form.add_file(f, 'application/octet-stream',
+                                      filename, name='files[]')
 
-        resp = _get_response(self.browser)
+            resp = _open_json(browser, browser.click())
+        finally:
+            for f in files:
+                f.close()
 
         if len(resp) != len(tracks):
             raise StravaError('Unexpected response')
 
 
-        return UploadStatus(self.browser, resp)
+        return UploadStatus(browser, resp, self.endpoints.upload_status)
+
+
+    def status(self, uploads):
 
+        return UploadStatus(self._api_browser, uploads,
+                            self.endpoints.upload_status)
 
 
 
 
 
+
+def _upload_finished(upload):
+    return upload['progress'] == 100 or 'error' in upload
+
+
 class UploadStatus(object):
 
-    def __init__(self, browser, uploads):
+    def __init__(self, browser, uploads, status_url):
         self.browser = browser
         self.uploads = uploads
+        self._status_url = status_url
+
+        # Latest known state of each upload, and the ids of the uploads
+        # that are still being processed
+        self._state = dict((u['id'], u) for u in uploads)
+        self._pending = [u['id'] for u in uploads]
 
-        self.finished = False
+        self.finished = not self._pending
         self.status_msg = ''
 
 
 
     def check_progress(self):
 
-        _open_url(self.browser, self._statusUrl())
+        # Only the uploads that haven't finished yet are queried, and only
+        # the ones whose state has changed since the last call are returned
+        if self.finished:
+            return True, []
 
+        resp = _open_json(self.browser, self._statusUrl())
 
-        resp = _get_response(self.browser)
-
-        if len(resp) != len(self.uploads):
+        if len(resp) != len(self._pending):
             raise StravaError('Unexpected response')
 
-        finished = True
+        changed = []
         for u in resp:
-            if u['progress'] != 100 and ('error' not in u):
-                finished = False
+            if u['id'] not in self._state:
+                raise StravaError('Unexpected response')
+            if u != self._state[u['id']]:
+                self._state[u['id']] = u
+                changed.append(u)
+
+        self._pending = [i for i in self._pending
+                         if not _upload_finished(self._state[i])]
+        self.finished = not self._pending
 
-        return finished, resp
+        return self.finished, changed
 
 
 
     def _statusUrl(self):
 
         ids = []
-        for t in self.uploads:
-            ids.append('ids[]=%s' % t['id'])
-
-        return _URL_UPLOAD_STATUS + '&' + '&'.join(ids)
+        for i in self._pending:
+            ids.append('ids[]=%s' % i)
 
+        sep = '&' if '?' in self._status_url else '?'
+        return self._status_url + sep + '&'.join(ids)
@@ -33,3 +33,18 @@ def resource_path(name):
 
     return os.path.join(_basedir, name)
 
+
+
+if sys.platform == 'win32':
+     _datadir = os.path.join(os.environ.get('APPDATA', os.path.expanduser('~')),
+                             'BrytonStravaUploader')
+else:
+     _datadir = os.path.join(os.path.expanduser('~'), '.bryton-strava-uploader')
+
+
+def data_path(name):
+
+    if not os.path.isdir(_datadir):
+        os.makedirs(_datadir)
+
+    return os.path.join(_datadir, name)
@@ -0,0 +1,309 @@
+#
+# Copyright (C) 2013  Per Myren
+#
+# This file is part of Bryton-Strava-Uploader
+#
+# Bryton-Strava-Uploader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bryton-Strava-Uploader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bryton-Strava-Uploader.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import sys
+import os
+import errno
+import hmac
+import hashlib
+import struct
+import base64
+import tempfile
+
+
+
+# Prefix of encrypted values, so they can be told from old plain text ones
+_PREFIX = 'v1:'
+
+_KEY_SIZE = 32
+_NONCE_SIZE = 16
+_MAC_SIZE = 32
+
+
+
+class VaultError(Exception):
+    pass
+
+
+class KeyFileError(VaultError):
+    """The key file couldn't be read or created, so values may decrypt once
+    it can be."""
+    pass
+
+
+
+class Vault(object):
+    """Encrypts the secrets the uploader keeps on disk.
+
+    Python 2 has no cipher in its standard library, and the uploader has no
+    crypto dependency to bundle, so values are encrypted with HMAC-SHA256 as
+    a keystream generator (in counter mode, with a random nonce) and then
+    authenticated with HMAC-SHA256.  The random key is created on first use
+    and stored in key_path, which only the current user can read.
+
+    This keeps the password and login session unreadable when the settings
+    or the session file get out on their own, like in a backup or a synced
+    folder, and detects values that have been changed.  On Windows the key
+    is protected with DPAPI, so it's only usable by the same user's login.
+    Elsewhere the key file sits unprotected next to the values, so anyone
+    who can read the user's files, or run code as the user, can decrypt them.
+
+    A damaged key file is replaced with a new key, and the values encrypted
+    with the old one can't be decrypted any more.  read() removes such files.
+    """
+
+    def __init__(self, key_path):
+
+        self._key_path = key_path
+        self._keys = None
+
+
+    def encrypt(self, data):
+        """Return data (a byte string) encrypted, as an ASCII string."""
+
+        enc_key, mac_key = self._getKeys()
+
+        nonce = os.urandom(_NONCE_SIZE)
+        body = nonce + _xor(data, _keystream(enc_key, nonce, len(data)))
+        mac = hmac.new(mac_key, body, hashlib.sha256).digest()
+
+        return _PREFIX + base64.b64encode(body + mac)
+
+
+    def decrypt(self, token):
+        """Return the data encrypted by encrypt().  Raises VaultError if
+        token wasn't encrypted with this vault's key or has been changed."""
+
+        if not isEncrypted(token):
+            raise VaultError('Not an encrypted value')
+
+        try:
+            raw = base64.b64decode(token[len(_PREFIX):])
+        except TypeError:
+            raise VaultError('Not an encrypted value')
+
+        if len(raw) < _NONCE_SIZE + _MAC_SIZE:
+            raise VaultError('Not an encrypted value')
+
+        enc_key, mac_key = self._getKeys()
+
+        body, mac = raw[:-_MAC_SIZE], raw[-_MAC_SIZE:]
+        if not hmac.compare_digest(
+                mac, hmac.new(mac_key, body, hashlib.sha256).digest()):
+            raise VaultError('Failed to decrypt value')
+
+        nonce, data = body[:_NONCE_SIZE], body[_NONCE_SIZE:]
+        return _xor(data, _keystream(enc_key, nonce, len(data)))
+
+
+    def write(self, path, data):
+        """Encrypt data and write it to the file path."""
+
+        token = self.encrypt(data)
+
+        tmp_path = path + '.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                     getattr(os, 'O_BINARY', 0), 0600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(token)
+
+        _replace(tmp_path, path)
+
+
+    def read(self, path):
+        """Return the data written to path, or None if there isn't any
+        that can be decrypted."""
+
+        try:
+            with open(path, 'rb') as f:
+                token = f.read()
+        except IOError:
+            return None
+
+        try:
+            return self.decrypt(token)
+        except KeyFileError:
+            return None
+        except VaultError:
+            # Damaged, or encrypted with a key that has been replaced, so it
+            # never will be decrypted
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+
+    def _getKeys(self):
+
+        if self._keys is None:
+            data = self._readKey()
+            try:
+                key = _unprotect(data)
+            except VaultError:
+                key = None
+
+            if key is None or len(key) != _KEY_SIZE:
+                # Nothing can be decrypted with a damaged key, so rather than
+                # failing for good it's replaced
+                try:
+                    key = _unprotect(self._createKey(_replace))
+                except EnvironmentError:
+                    raise KeyFileError('Failed to create key file')
+
+            # Separate keys for encryption and authentication
+            self._keys = (hmac.new(key, 'encrypt', hashlib.sha256).digest(),
+                          hmac.new(key, 'authenticate', hashlib.sha256).digest())
+
+        return self._keys
+
+
+    def _readKey(self):
+
+        try:
+            with open(self._key_path, 'rb') as f:
+                return f.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise KeyFileError('Failed to read key file')
+
+        try:
+            return self._createKey(_putInPlace)
+        except EnvironmentError as e:
+            if e.errno != errno.EEXIST:
+                raise KeyFileError('Failed to create key file')
+
+        # Created by another thread in the meantime
+        try:
+            with open(self._key_path, 'rb') as f:
+                return f.read()
+        except IOError:
+            raise KeyFileError('Failed to read key file')
+
+
+    def _createKey(self, put):
+
+        # The key is written to a temporary file and then put in place with
+        # put, so that another thread never reads it half written
+        try:
+            data = _protect(os.urandom(_KEY_SIZE))
+        except VaultError as e:
+            raise KeyFileError(str(e))
+
+        fd, tmp_path = tempfile.mkstemp(
+            suffix='.tmp', dir=os.path.dirname(self._key_path) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            put(tmp_path, self._key_path)
+        finally:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+        return data
+
+
+
+def isEncrypted(value):
+    """Return True if value looks like it was returned by Vault.encrypt()."""
+
+    return value.startswith(_PREFIX)
+
+
+
+def _putInPlace(tmp_path, path):
+
+    # Unlike rename on POSIX, link fails if path exists, rather than
+    # replacing a key another thread has started using.  Rename on Windows
+    # fails too.
+    if hasattr(os, 'link'):
+        os.link(tmp_path, path)
+    else:
+        os.rename(tmp_path, path)
+
+
+def _replace(tmp_path, path):
+
+    if sys.platform == 'win32' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def _keystream(key, nonce, length):
+
+    blocks = []
+    for i in xrange((length + 31) // 32):
+        blocks.append(hmac.new(key, nonce + struct.pack('>Q', i),
+                               hashlib.sha256).digest())
+    return ''.join(blocks)[:length]
+
+
+def _xor(a, b):
+
+    return ''.join(chr(ord(x) ^ ord(y)) for x, y in zip(a, b))
+
+
+
+if sys.platform == 'win32':
+
+    import ctypes
+    from ctypes import wintypes
+
+    class _DataBlob(ctypes.Structure):
+        _fields_ = [('cbData', wintypes.DWORD),
+                    ('pbData', ctypes.POINTER(ctypes.c_char))]
+
+    _CRYPTPROTECT_UI_FORBIDDEN = 0x01
+
+
+    def _dpapi(func, data):
+
+        buf = ctypes.create_string_buffer(data, len(data))
+        blob_in = _DataBlob(len(data),
+                            ctypes.cast(buf, ctypes.POINTER(ctypes.c_char)))
+        blob_out = _DataBlob()
+
+        if not func(ctypes.byref(blob_in), None, None, None, None,
+                    _CRYPTPROTECT_UI_FORBIDDEN, ctypes.byref(blob_out)):
+            raise VaultError('Failed to protect key')
+
+        try:
+            return ctypes.string_at(blob_out.pbData, blob_out.cbData)
+        finally:
+            ctypes.windll.kernel32.LocalFree(blob_out.pbData)
+
+
+    def _protect(key):
+        return _dpapi(ctypes.windll.crypt32.CryptProtectData, key)
+
+    def _unprotect(data):
+        return _dpapi(ctypes.windll.crypt32.CryptUnprotectData, data)
+
+else:
+
+    # The key file's permissions are all the protection there is
+    def _protect(key):
+        return key
+
+    def _unprotect(data):
+        return data
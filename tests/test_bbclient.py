@@ -0,0 +1,76 @@
+#
+# Copyright (C) 2013  Per Myren
+#
+# This file is part of Bryton-Strava-Uploader
+#
+# Bryton-Strava-Uploader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bryton-Strava-Uploader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bryton-Strava-Uploader.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+
+try:
+    from strava_uploader.bbclient import _TrackMatcher
+except ImportError:
+    # PyQt4 isn't installed
+    _TrackMatcher = None
+
+
+
+@unittest.skipIf(_TrackMatcher is None, 'PyQt4 is not installed')
+class TrackMatcherTest(unittest.TestCase):
+
+    tracks = ['2013/05/01 10:00', '2013/05/01 10:00 2', '2013/05/02 11:00',
+              '2013/05/03 09:30', '2013/05/03 09:30']
+
+
+    def test_match(self):
+
+        matcher = _TrackMatcher(self.tracks, [0, 2])
+
+        self.assertEqual(matcher.match('201305021100.tcx'), 2)
+        self.assertEqual(matcher.match('201305011000.tcx'), 0)
+        self.assertEqual(matcher.unmatched(), [])
+
+
+    def test_longest_name_wins(self):
+
+        matcher = _TrackMatcher(self.tracks, [0, 1])
+
+        self.assertEqual(matcher.match('2013050110002.tcx'), 1)
+        self.assertEqual(matcher.match('201305011000.tcx'), 0)
+
+
+    def test_each_track_matched_once(self):
+
+        matcher = _TrackMatcher(self.tracks, [2, 3, 4])
+
+        self.assertEqual(matcher.match('201305030930.tcx'), 3)
+        self.assertEqual(matcher.match('201305030930.tcx'), 4)
+        self.assertEqual(matcher.match('201305030930.tcx'), None)
+        self.assertEqual(matcher.unmatched(), [2])
+
+
+    def test_unknown_file(self):
+
+        matcher = _TrackMatcher(self.tracks, [0, 2])
+
+        self.assertEqual(matcher.match('something.tcx'), None)
+        self.assertEqual(matcher.match('201305030930.tcx'), None)
+        self.assertEqual(matcher.unmatched(), [0, 2])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
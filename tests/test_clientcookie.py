@@ -0,0 +1,106 @@
+#
+# Copyright (C) 2013  Per Myren
+#
+# This file is part of Bryton-Strava-Uploader
+#
+# Bryton-Strava-Uploader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bryton-Strava-Uploader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bryton-Strava-Uploader.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+import unittest
+
+from strava_uploader import mechanize
+
+
+
+def _cookie(name, value, domain, path='/', expires=None):
+
+    dot = domain.startswith('.')
+    return mechanize.Cookie(0, name, value, None, False, domain, dot, dot,
+                            path, path != '/', False, expires, expires is None,
+                            None, None, {})
+
+
+def _header(jar, url):
+
+    request = mechanize.Request(url)
+    jar.add_cookie_header(request)
+    return request.get_header('Cookie')
+
+
+
+class CookieLookupTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.jar = mechanize.CookieJar()
+        self.jar.set_cookie(_cookie('site', '1', '.example.com'))
+        self.jar.set_cookie(_cookie('host', '2', 'www.example.com'))
+        self.jar.set_cookie(_cookie('upload', '3', 'www.example.com',
+                                    '/upload'))
+        self.jar.set_cookie(_cookie('other', '4', '.other.com'))
+
+
+    def test_domain_suffixes(self):
+
+        self.assertEqual(_header(self.jar, 'http://www.example.com/'),
+                         'host=2; site=1')
+        self.assertEqual(_header(self.jar, 'http://a.b.example.com/'),
+                         'site=1')
+        self.assertEqual(_header(self.jar, 'http://example.com/'), 'site=1')
+        self.assertEqual(_header(self.jar, 'http://notexample.com/'), None)
+        self.assertEqual(_header(self.jar, 'http://www.other.com/'), 'other=4')
+
+
+    def test_path_prefixes(self):
+
+        self.assertEqual(_header(self.jar, 'http://www.example.com/upload/x'),
+                         'upload=3; host=2; site=1')
+        self.assertEqual(_header(self.jar, 'http://www.example.com/up'),
+                         'host=2; site=1')
+        self.assertEqual(_header(self.jar, 'http://www.example.com/x/upload'),
+                         'host=2; site=1')
+
+
+    def test_memo_follows_changes(self):
+
+        url = 'http://www.example.com/'
+        self.assertEqual(_header(self.jar, url), 'host=2; site=1')
+
+        self.jar.set_cookie(_cookie('host', '5', 'www.example.com'))
+        self.assertEqual(_header(self.jar, url), 'host=5; site=1')
+
+        self.jar.clear('.example.com')
+        self.assertEqual(_header(self.jar, url), 'host=5')
+
+        self.jar.clear()
+        self.assertEqual(_header(self.jar, url), None)
+
+
+    def test_expired_cookie_is_dropped(self):
+
+        url = 'http://www.other.com/'
+        self.jar.set_cookie(_cookie('soon', '6', '.other.com',
+                                    expires=int(time.time()) + 1))
+        self.assertEqual(_header(self.jar, url), 'other=4; soon=6')
+
+        time.sleep(2)
+        self.assertEqual(_header(self.jar, url), 'other=4')
+        self.assertEqual(len(self.jar), 4)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#
+# Copyright (C) 2013  Per Myren
+#
+# This file is part of Bryton-Strava-Uploader
+#
+# Bryton-Strava-Uploader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bryton-Strava-Uploader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bryton-Strava-Uploader.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+
+try:
+    from PyQt4.QtCore import Qt, QVariant
+    from strava_uploader.main import TrackListModel
+except ImportError:
+    # PyQt4 isn't installed
+    TrackListModel = None
+
+
+
+@unittest.skipIf(TrackListModel is None, 'PyQt4 is not installed')
+class TrackListModelTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.model = TrackListModel()
+        self.changes = []
+        self.model.rowsRemoved.connect(
+            lambda parent, first, last:
+                self.changes.append(('removed', first, last)))
+        self.model.rowsInserted.connect(
+            lambda parent, first, last:
+                self.changes.append(('inserted', first, last)))
+        self.model.dataChanged.connect(
+            lambda first, last: self.changes.append(('changed',)))
+
+
+    def setTracks(self, tracks):
+
+        del self.changes[:]
+        self.model.setTracks(tracks)
+        self.assertEqual(self.model.rowCount(), len(tracks))
+
+
+    def test_new_tracks(self):
+
+        self.setTracks(['a', 'b', 'c'])
+
+        self.assertEqual(self.changes, [('inserted', 0, 2)])
+        # Only the latest track is checked
+        self.assertEqual(self.model.checkedRows(), [2])
+
+
+    def test_unchanged(self):
+
+        self.setTracks(['a', 'b', 'c'])
+        self.setTracks(['a', 'b', 'c'])
+
+        self.assertEqual(self.changes, [])
+
+
+    def test_added_track(self):
+
+        self.setTracks(['a', 'b', 'c'])
+        self.model.setData(self.model.index(0), QVariant(Qt.Checked),
+                           Qt.CheckStateRole)
+        self.setTracks(['a', 'b', 'c', 'd'])
+
+        self.assertEqual(self.changes, [('inserted', 3, 3)])
+        self.assertEqual(self.model.checkedRows(), [0, 2, 3])
+
+
+    def test_replaced_track(self):
+
+        self.setTracks(['a', 'b', 'c', 'd'])
+        self.setTracks(['a', 'x', 'c', 'd'])
+
+        self.assertEqual(self.changes, [('removed', 1, 1), ('inserted', 1, 1)])
+        self.assertEqual(self.model.checkedRows(), [3])
+
+
+    def test_removed_tracks(self):
+
+        self.setTracks(['a', 'b', 'c', 'd'])
+        self.setTracks(['a', 'd'])
+
+        self.assertEqual(self.changes, [('removed', 1, 2)])
+        self.assertEqual(self.model.checkedRows(), [1])
+
+        self.setTracks([])
+        self.assertEqual(self.model.checkedRows(), [])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
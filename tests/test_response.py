@@ -0,0 +1,114 @@
+#
+# Copyright (C) 2013  Per Myren
+#
+# This file is part of Bryton-Strava-Uploader
+#
+# Bryton-Strava-Uploader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bryton-Strava-Uploader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bryton-Strava-Uploader.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+import copy
+import unittest
+from StringIO import StringIO
+
+from strava_uploader.mechanize._response import _Cache, seek_wrapper
+
+
+
+class CacheTest(unittest.TestCase):
+
+    def test_empty(self):
+
+        cache = _Cache()
+        self.assertEqual(cache.length, 0)
+        self.assertEqual(cache.getvalue(), '')
+        self.assertEqual(cache.read(0, 10), '')
+        self.assertEqual(cache.readline(0), '')
+
+
+    def test_single_append_is_not_copied(self):
+
+        data = 'line 1\nline 2\n' * 10
+        cache = _Cache()
+        cache.append(data)
+
+        self.assertTrue(cache.getvalue() is data)
+        self.assertTrue(cache.read(0, len(data)) is data)
+        self.assertEqual(cache.read(7, 6), 'line 2')
+
+
+    def test_appends(self):
+
+        cache = _Cache()
+        for data in ('ab', '', 'c\nde', 'f\n', 'g'):
+            cache.append(data)
+
+        self.assertEqual(cache.length, 9)
+        self.assertEqual(cache.getvalue(), 'abc\ndef\ng')
+        self.assertEqual(cache.read(2, 4), 'c\nde')
+        self.assertEqual(cache.read(8, 10), 'g')
+        self.assertEqual(cache.read(9, 1), '')
+        self.assertEqual(cache.read(3, 0), '')
+
+        cache.append('h')
+        self.assertEqual(cache.getvalue(), 'abc\ndef\ngh')
+
+
+    def test_readline(self):
+
+        cache = _Cache()
+        cache.append('abc\n')
+        cache.append('def\ng')
+
+        self.assertEqual(cache.readline(0), 'abc\n')
+        self.assertEqual(cache.readline(4), 'def\n')
+        self.assertEqual(cache.readline(8), 'g')
+        self.assertEqual(cache.readline(4, 2), 'de')
+
+
+
+class SeekWrapperTest(unittest.TestCase):
+
+    def test_read_seek(self):
+
+        data = ''.join('line %d\n' % i for i in range(100))
+        sw = seek_wrapper(StringIO(data))
+
+        self.assertEqual(sw.read(10), data[:10])
+        self.assertEqual(sw.readline(), data[10:data.index('\n', 10) + 1])
+        sw.seek(0)
+        self.assertEqual(sw.read(), data)
+        # Offsets from the end are positive
+        sw.seek(7, 2)
+        self.assertEqual(sw.read(), 'ine 99\n')
+        sw.seek(0)
+        self.assertEqual(sw.readlines(), data.splitlines(True))
+
+
+    def test_copies_share_the_cache(self):
+
+        sw = seek_wrapper(StringIO('abcdef'))
+        self.assertEqual(sw.read(2), 'ab')
+
+        # A copy starts at the beginning, and reads what the original has
+        # read from the cache
+        other = copy.copy(sw)
+        self.assertEqual(other.read(4), 'abcd')
+        self.assertEqual(sw.read(), 'cdef')
+        self.assertEqual(other.read(), 'ef')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#
+# Copyright (C) 2013  Per Myren
+#
+# This file is part of Bryton-Strava-Uploader
+#
+# Bryton-Strava-Uploader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Bryton-Strava-Uploader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Bryton-Strava-Uploader.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from strava_uploader.vault import Vault, VaultError, isEncrypted
+
+
+
+class VaultTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.key_path = os.path.join(self.dir, 'vault.key')
+        self.path = os.path.join(self.dir, 'secret')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def test_round_trip(self):
+
+        token = Vault(self.key_path).encrypt('s3cret\x00\xff')
+
+        self.assertTrue(isEncrypted(token))
+        self.assertNotIn('s3cret', token)
+        # A new vault reads the key created by the first one
+        self.assertEqual(Vault(self.key_path).decrypt(token), 's3cret\x00\xff')
+
+
+    def test_random_nonce(self):
+
+        vault = Vault(self.key_path)
+        self.assertNotEqual(vault.encrypt('data'), vault.encrypt('data'))
+
+
+    def test_key_file_is_private(self):
+
+        Vault(self.key_path).encrypt('data')
+
+        if os.name == 'posix':
+            self.assertEqual(os.stat(self.key_path).st_mode & 0777, 0600)
+        self.assertEqual(os.listdir(self.dir), ['vault.key'])
+
+
+    def test_tampered_value(self):
+
+        vault = Vault(self.key_path)
+        token = vault.encrypt('data')
+
+        raw = token[3:].decode('base64')
+        for i in (0, 20, len(raw) - 1):
+            changed = raw[:i] + chr(ord(raw[i]) ^ 1) + raw[i + 1:]
+            self.assertRaises(VaultError, vault.decrypt,
+                              token[:3] + changed.encode('base64'))
+
+        self.assertRaises(VaultError, vault.decrypt, token[:-8])
+        self.assertRaises(VaultError, vault.decrypt, 'plain text')
+        self.assertRaises(VaultError, vault.decrypt, 'v1:***')
+
+
+    def test_other_key(self):
+
+        token = Vault(self.key_path).encrypt('data')
+        other = Vault(os.path.join(self.dir, 'other.key'))
+        self.assertRaises(VaultError, other.decrypt, token)
+
+
+    def test_write_read(self):
+
+        vault = Vault(self.key_path)
+        vault.write(self.path, 'data')
+
+        self.assertTrue(isEncrypted(open(self.path, 'rb').read()))
+        self.assertEqual(Vault(self.key_path).read(self.path), 'data')
+        self.assertEqual(vault.read(os.path.join(self.dir, 'missing')), None)
+
+
+    def test_damaged_key_is_replaced(self):
+
+        Vault(self.key_path).write(self.path, 'data')
+        with open(self.key_path, 'wb') as f:
+            f.write('truncated')
+
+        vault = Vault(self.key_path)
+        # The value can't be decrypted any more, so it's removed
+        self.assertEqual(vault.read(self.path), None)
+        self.assertFalse(os.path.exists(self.path))
+
+        # and new values can be stored
+        vault.write(self.path, 'new')
+        self.assertEqual(Vault(self.key_path).read(self.path), 'new')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,8 @@
+from strava_uploader import startup
+startup.start()
+
+from strava_uploader import importprofile
+importprofile.start()
 
 from strava_uploader import main
 